@@ -0,0 +1,265 @@
+"""
+Reproducible benchmark for ingestion, retrieval, reranking and full queries.
+
+Groq models are replaced by deterministic offline stand-ins, so results only
+depend on the local parsing, embedding and reranking stack. Output is JSON,
+suitable for diffing between commits.
+
+    python "Performance Check/benchmark.py" --output bench.json
+    python "Performance Check/benchmark.py" --repeats 5 --llm-latency-ms 300
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+
+# Groq clients in config.py are lazy and never built here; the key only has to be set
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+
+from offline_models import OfflineChatModel, OfflineVisionClient
+from document_process import DocumentProcessor, IndexedDocument
+from rag_pipeline import RAG_Pipeline
+from postRetrievalReranker import ReRanker_Model
+from session_manager import SessionManager
+from config import hf_reranker_encoder, hf_embeddings, vision_model, llm_rate_limits, default_llm_rate_limit
+from llm_gateway import llm_gateway
+from lazy_loading import resolve
+from langchain.chains import HypotheticalDocumentEmbedder
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    idx = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[idx]
+
+
+def summarize_latencies(samples_s: list) -> dict:
+    values = sorted(s * 1000 for s in samples_s)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 2),
+        "min_ms": round(values[0], 2),
+        "p50_ms": round(percentile(values, 50), 2),
+        "p90_ms": round(percentile(values, 90), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "max_ms": round(values[-1], 2),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def relevant_chunk_ids(sections, evidence: list) -> set:
+    """Sections whose text contains any evidence phrase count as relevant"""
+    phrases = [_normalize(e) for e in evidence]
+    return {
+        chunk_id for chunk_id, text in enumerate(sections.texts())
+        if any(p in _normalize(text) for p in phrases)
+    }
+
+
+def to_section_ids(passages, passage_ids) -> list:
+    """Child passages count towards their parent section, ranked by first appearance"""
+    return list(dict.fromkeys(int(passages.parent_ids[i]) for i in passage_ids))
+
+
+def ranking_metrics(ranked_lists, relevant_sets, ks) -> dict:
+    """Mean recall@k and MRR over questions that have at least one relevant section"""
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks = []
+    for ids, relevant in zip(ranked_lists, relevant_sets):
+        if not relevant:
+            continue
+        for k in ks:
+            recalls[k].append(len(relevant & set(ids[:k])) / len(relevant))
+        rank = next((i for i, cid in enumerate(ids, 1) if cid in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+
+    evaluated = len(reciprocal_ranks)
+    return {
+        "evaluated_questions": evaluated,
+        **{f"recall@{k}": round(sum(v) / evaluated, 4) if evaluated else None for k, v in recalls.items()},
+        "mrr": round(sum(reciprocal_ranks) / evaluated, 4) if evaluated else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def run_benchmark(pdf_path: str, questions: list, repeats: int, llm_latency_s: float,
+                  concurrency: int = 20, llm_tokens_per_minute: int = 0) -> dict:
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pdf": os.path.basename(pdf_path),
+            "questions": len(questions),
+            "repeats": repeats,
+            "llm_latency_ms": llm_latency_s * 1000,
+            "concurrency": concurrency,
+            "llm_tokens_per_minute": llm_tokens_per_minute or None,
+        },
+        "peak_rss_mb": {"startup": peak_rss_mb()},
+    }
+
+    llm = OfflineChatModel(latency_s=llm_latency_s)
+    # The stand-ins have no provider quota: keep the gateway's concurrency caps, but no token
+    # bucket unless asked for, so the run measures the pipeline rather than limiter sleeps
+    for model in (getattr(llm, "model_name", type(llm).__name__), vision_model):
+        limits = llm_rate_limits.get(model, default_llm_rate_limit)
+        llm_gateway.configure(model, limits["max_concurrency"], llm_tokens_per_minute or None)
+    document_processor = DocumentProcessor()
+    document_processor.multimodal_processor.llm = llm
+    document_processor.multimodal_processor.groq_client = OfflineVisionClient(latency_s=llm_latency_s)
+    rag_pipeline = RAG_Pipeline(llm)
+    # HyDE escalations write their hypothetical passage with the offline model too
+    rag_pipeline.hyde_embedder = HypotheticalDocumentEmbedder.from_llm(
+        llm=llm, base_embeddings=resolve(hf_embeddings), prompt_key="sci_fact")
+    reranker = ReRanker_Model(hf_reranker_encoder)
+    session_manager = SessionManager()
+
+    # Ingestion: partition + chunk + image descriptions, then embed + index
+    parsed, parse_s = timed(document_processor.load_and_process_pdf, pdf_path)
+    sections, passages, dedup_stats, _ = parsed
+    retriever, index_s = timed(document_processor.create_retriever, passages)
+    document_processor.publish(IndexedDocument(*parsed, retriever))
+    rag_pipeline.set_reranker(reranker)
+    rag_pipeline.set_document_processor(document_processor)
+    rag_chain = rag_pipeline.create_rag_chain()
+    rag_pipeline.create_conversational_chain(rag_chain, session_manager.get_session_history)
+
+    report["ingestion"] = {
+        "parse_and_chunk_s": round(parse_s, 3),
+        "embed_and_index_s": round(index_s, 3),
+        "total_s": round(parse_s + index_s, 3),
+        "chunks": len(sections),
+        "child_passages": len(passages),
+        **dedup_stats,
+        "tables": len(sections.tables),
+        "images": len(sections.image_descriptions),
+        "chunk_store_bytes": sections.nbytes + passages.nbytes,
+    }
+    report["peak_rss_mb"]["after_ingestion"] = peak_rss_mb()
+
+    texts = [q["question"] for q in questions]
+    relevant = [relevant_chunk_ids(sections, q["evidence"]) for q in questions]
+
+    retrieve_s, rerank_s, query_s = [], [], []
+    retrieved_lists, reranked_lists = [], []
+    for rep in range(repeats):
+        rag_pipeline.clear_summary_cache()
+        for i, question in enumerate(texts):
+            candidates, elapsed = timed(retriever.invoke, question)
+            retrieve_s.append(elapsed)
+            reranked, elapsed = timed(reranker.rerank, question, candidates, passages)
+            rerank_s.append(elapsed)
+            if rep == 0:
+                retrieved_lists.append(to_section_ids(passages, candidates))
+                reranked_lists.append(to_section_ids(passages, [i for i, _ in reranked]))
+
+            # A fresh session per call keeps chat history from growing across the run
+            _, elapsed = timed(rag_pipeline.query, question, f"bench-{rep}-{i}")
+            query_s.append(elapsed)
+
+    report["stages"] = {
+        "retrieve": summarize_latencies(retrieve_s),
+        "rerank": summarize_latencies(rerank_s),
+        "query": summarize_latencies(query_s),
+    }
+    report["peak_rss_mb"]["after_queries"] = peak_rss_mb()
+
+    rag_pipeline.clear_summary_cache()
+    _, batch_s = timed(rag_pipeline.query_batch, texts)
+
+    # Concurrent users: embedding and cross-encoder calls are micro-batched across threads
+    def retrieve_and_rerank(question):
+        return reranker.rerank(question, retriever.invoke(question), passages)
+
+    concurrent_questions = texts * repeats
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        _, concurrent_s = timed(lambda: list(pool.map(retrieve_and_rerank, concurrent_questions)))
+
+    sequential_retrieval_s = sum(retrieve_s) + sum(rerank_s)
+    report["throughput"] = {
+        "sequential_retrieve_rerank_qps": round(len(retrieve_s) / sequential_retrieval_s, 3) if sequential_retrieval_s else None,
+        "concurrent_retrieve_rerank_qps": round(len(concurrent_questions) / concurrent_s, 3) if concurrent_s else None,
+        "sequential_query_qps": round(len(query_s) / sum(query_s), 3) if query_s else None,
+        "batch_query_qps": round(len(texts) / batch_s, 3) if batch_s else None,
+        "batch_wall_s": round(batch_s, 3),
+    }
+    report["peak_rss_mb"]["after_batch"] = peak_rss_mb()
+
+    report["retrieval_quality"] = {
+        "hybrid": ranking_metrics(retrieved_lists, relevant, ks=(1, 3, 5, 10)),
+        "reranked": ranking_metrics(reranked_lists, relevant, ks=(1, 3)),
+        "questions_without_evidence": sum(1 for r in relevant if not r),
+    }
+    report["hyde"] = rag_pipeline.hyde_stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ResearchPro benchmark")
+    parser.add_argument("--pdf", default=os.path.join(HERE, "test_paper.pdf"))
+    parser.add_argument("--questions", default=os.path.join(HERE, "benchmark_questions.json"))
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the question set")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="Simulated latency per fake LLM / vision call")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="Simulated concurrent users for the retrieve + rerank throughput run")
+    parser.add_argument("--llm-tokens-per-minute", type=int, default=0,
+                        help="Token-rate limit for the fake models in the LLM gateway (0 = none)")
+    parser.add_argument("--output", help="Write the JSON report to this path instead of stdout")
+    args = parser.parse_args()
+
+    with open(args.questions, encoding="utf-8") as f:
+        questions = json.load(f)
+
+    report = run_benchmark(args.pdf, questions, args.repeats, args.llm_latency_ms / 1000, args.concurrency,
+                           args.llm_tokens_per_minute)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
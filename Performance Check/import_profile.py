@@ -0,0 +1,144 @@
+"""
+Cold-start import profile and import-time budget check.
+
+Imports the API module in fresh interpreters with `python -X importtime`, reports
+per-module import times (repo modules and the heaviest third-party packages) and
+exits non-zero when the cold import exceeds the budget or pulls in a dependency
+that query-only workers must never load (PDF partitioning stack, torch, models).
+
+    python "Performance Check/import_profile.py"
+    python "Performance Check/import_profile.py" --budget-ms 1000 --output imports.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+
+# Loaded on first ingestion / first model call only
+FORBIDDEN_AT_STARTUP = (
+    "unstructured",
+    "torch",
+    "sentence_transformers",
+    "transformers",
+    "langchain_huggingface",
+    "langchain_groq",
+    "groq",
+    "faiss",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def repo_modules() -> set:
+    return {name[:-3] for name in os.listdir(REPO_ROOT) if name.endswith(".py")}
+
+
+def run_import(module: str) -> tuple:
+    """Import the module in a fresh interpreter; returns (importtime lines, forbidden modules loaded)"""
+    probe = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {list(FORBIDDEN_AT_STARTUP)!r} if m in sys.modules]))"
+    )
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "import-profile")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=REPO_ROOT,
+                            env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return result.stderr.splitlines(), json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def parse_importtime(lines: list) -> list:
+    """(module, self_ms, cumulative_ms, depth) for each -X importtime entry"""
+    entries = []
+    for line in lines:
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    return entries
+
+
+def import_tree(entries: list, module: str) -> list:
+    """Entries imported on behalf of `module` (children are listed before their parent)"""
+    end = next((i for i, (name, _, _, depth) in enumerate(entries) if name == module and depth == 0), None)
+    if end is None:
+        return []
+    start = end
+    while start > 0 and entries[start - 1][3] > 0:
+        start -= 1
+    return entries[start:end + 1]
+
+
+def profile(module: str, runs: int) -> dict:
+    """Fastest of several cold imports (the others are mostly disk-cache and scheduler noise)"""
+    best = None
+    for _ in range(runs):
+        lines, forbidden = run_import(module)
+        entries = import_tree(parse_importtime(lines), module)
+        total_ms = entries[-1][2] if entries else 0.0
+        if best is None or total_ms < best[0]:
+            best = (total_ms, entries, forbidden)
+    total_ms, entries, forbidden = best
+
+    ours = repo_modules()
+    repo = {name: {"self_ms": round(self_ms, 1), "cumulative_ms": round(cum, 1)}
+            for name, self_ms, cum, _ in entries if name in ours}
+
+    # Third-party cost: largest cumulative time among each top-level package's modules
+    packages = {}
+    for name, _, cum, _ in entries:
+        root = name.split(".")[0]
+        if root in ours or root.startswith("_"):
+            continue
+        packages[root] = max(packages.get(root, 0.0), cum)
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])[:15]
+
+    return {
+        "module": module,
+        "total_ms": round(total_ms, 1),
+        "modules_imported": len(entries),
+        "repo_modules": dict(sorted(repo.items(), key=lambda item: -item[1]["cumulative_ms"])),
+        "heaviest_packages_ms": {name: round(ms, 1) for name, ms in heaviest},
+        "forbidden_loaded": forbidden,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import profile / budget check")
+    parser.add_argument("--module", default="app", help="Module to import (default: the FastAPI app)")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters; the fastest counts")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")),
+                        help="Fail when the cold import takes longer than this")
+    parser.add_argument("--output", help="Write the JSON report to this path instead of stdout")
+    args = parser.parse_args()
+
+    report = profile(args.module, args.runs)
+    report["budget_ms"] = args.budget_ms
+
+    failures = []
+    if report["total_ms"] > args.budget_ms:
+        failures.append(f"import {args.module} took {report['total_ms']} ms (budget {args.budget_ms} ms)")
+    if report["forbidden_loaded"]:
+        failures.append(f"import {args.module} loaded {', '.join(report['forbidden_loaded'])}")
+    report["passed"] = not failures
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Import profile written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
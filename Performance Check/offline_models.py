@@ -0,0 +1,56 @@
+"""
+Deterministic stand-ins for the Groq chat models and vision client, so the
+pipeline can be benchmarked without network access or API spend.
+"""
+import hashlib
+import time
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import BaseMessage
+
+
+class OfflineChatModel(SimpleChatModel):
+    """Echoes the start of the last message, with an optional fixed latency"""
+
+    latency_s: float = 0.0
+    max_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "offline-chat-model"
+
+    def _call(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+              run_manager=None, **kwargs: Any) -> str:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        content = messages[-1].content if messages else ""
+        if not isinstance(content, str):
+            content = str(content)
+        # The reformulation prompt ends with the user question, so echoing it
+        # keeps the rewritten query identical to the original
+        return " ".join(content.split()[:self.max_words])
+
+
+class _OfflineCompletions:
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+
+    def create(self, model: str, messages: list, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        payload = ""
+        for part in messages[-1].get("content", []):
+            if part.get("type") == "image_url":
+                payload = part["image_url"]["url"]
+        digest = hashlib.sha1(payload.encode()).hexdigest()[:10]
+        text = f"Figure {digest}: a chart with labelled axes comparing model performance across cohorts."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+class OfflineVisionClient:
+    """Mimics groq.Groq().chat.completions.create for image descriptions"""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.chat = SimpleNamespace(completions=_OfflineCompletions(latency_s))
@@ -0,0 +1,109 @@
+"""
+Scaling check for sharded scatter-gather retrieval.
+
+Builds synthetic corpora (Zipf-distributed words, random bge-sized vectors) of
+several sizes, indexes each in-process and across N shard processes, and reports
+per-query retrieval latency and passages searched per millisecond. With enough
+cores, latency should stay roughly flat when shards grow with the corpus.
+
+    python "Performance Check/shard_scaling.py"
+    python "Performance Check/shard_scaling.py" --sizes 50000,200000 --shards 1,4,8 --output shards.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+
+from batch_retrieval import BatchHybridRetriever
+from sharded_retrieval import ShardedRetriever
+from benchmark import summarize_latencies
+
+DIM = 384
+WORDS_PER_PASSAGE = 100
+
+
+class RandomQueryEmbeddings:
+    """Deterministic unit vectors per query text; no model needed"""
+
+    def embed_documents(self, texts: list) -> np.ndarray:
+        vectors = np.stack([np.random.RandomState(zlib.crc32(t.encode())).randn(DIM) for t in texts])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def synthetic_corpus(size: int, vocab_size: int, seed: int = 0) -> tuple:
+    rng = np.random.RandomState(seed)
+    vocab = np.array([f"term{i}" for i in range(vocab_size)])
+    zipf = 1 / np.arange(1, vocab_size + 1)
+    zipf /= zipf.sum()
+    words = rng.choice(vocab_size, size=(size, WORDS_PER_PASSAGE), p=zipf)
+    texts = [" ".join(vocab[row]) for row in words]
+    vectors = rng.randn(size, DIM).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = [" ".join(vocab[rng.choice(vocab_size, size=6, p=zipf)]) for _ in range(64)]
+    return texts, vectors, queries
+
+
+def measure(retriever, queries: list, repeats: int) -> list:
+    retriever.retrieve(queries[:4])  # warm up pipes and caches
+    samples = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            retriever.invoke(query)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded retrieval scaling check")
+    parser.add_argument("--sizes", default="25000,50000,100000", help="Comma-separated corpus sizes (passages)")
+    parser.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts (1 = in-process)")
+    parser.add_argument("--vocab", type=int, default=30000)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the 64 queries")
+    parser.add_argument("--output", help="Write the JSON report to this path instead of stdout")
+    args = parser.parse_args()
+
+    embeddings = RandomQueryEmbeddings()
+    report = {"cpus": os.cpu_count(), "dim": DIM, "k": args.k, "runs": []}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        texts, vectors, queries = synthetic_corpus(size, args.vocab)
+        for shards in [int(n) for n in args.shards.split(",")]:
+            start = time.perf_counter()
+            if shards > 1:
+                retriever = ShardedRetriever(texts, vectors, embeddings, shards, k=args.k, timeout_ms=10_000)
+            else:
+                retriever = BatchHybridRetriever.build(texts, vectors, embeddings, k=args.k)
+            build_s = time.perf_counter() - start
+            try:
+                latency = summarize_latencies(measure(retriever, queries, args.repeats))
+            finally:
+                retriever.close()
+            report["runs"].append({
+                "passages": size,
+                "shards": shards,
+                "build_s": round(build_s, 2),
+                "latency": latency,
+                "passages_per_ms_p50": round(size / latency["p50_ms"], 1),
+            })
+            print(f"{size:>8} passages  {shards:>2} shards  p50 {latency['p50_ms']:>8} ms", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Shard scaling report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from config import admission_lanes, session_queries_per_minute, client_requests_per_minute, rate_limit_max_keys
+from llm_gateway import TokenBucket
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_SHED
+
+
+def _shed(lane: str, reason: str):
+    ADMISSION_SHED.labels(lane=lane, reason=reason).inc()
+    shed_counts[lane][reason] = shed_counts[lane].get(reason, 0) + 1
+
+
+def _reject(status_code: int, detail: str, retry_after_s: float):
+    raise HTTPException(status_code=status_code, detail=detail,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after_s)))})
+
+
+class AdmissionLane:
+    """
+    Worker-slot limit with a bounded wait queue. Requests beyond max_queue, or
+    that wait longer than queue_timeout_s, are shed with 503 and a Retry-After
+    estimated from the smoothed service time.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, queue_timeout_s: float):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.semaphore = asyncio.Semaphore(max_workers)
+        self.waiting = 0
+        self.in_flight = 0
+        self.service_s = 1.0
+
+    def retry_after_s(self) -> float:
+        return (self.waiting + 1) / self.max_workers * self.service_s
+
+    def check_capacity(self):
+        """Fail fast before doing any work (e.g. reading an upload) when the queue is already full"""
+        if self.waiting >= self.max_queue:
+            _shed(self.name, "queue_full")
+            _reject(503, f"Server busy: {self.name} queue is full", self.retry_after_s())
+
+    async def _wait_for_worker(self):
+        self.check_capacity()
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.labels(lane=self.name).set(self.waiting)
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            _shed(self.name, "queue_timeout")
+            _reject(503, f"Server busy: waited over {self.queue_timeout_s:g}s for a {self.name} worker",
+                    self.retry_after_s())
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.labels(lane=self.name).set(self.waiting)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore.locked():
+            await self._wait_for_worker()
+        else:
+            # A free worker is taken without suspending, so it never counts as queued
+            await self.semaphore.acquire()
+
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(lane=self.name).set(self.in_flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.service_s += 0.2 * (time.monotonic() - start - self.service_s)
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.labels(lane=self.name).set(self.in_flight)
+            self.semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {"queue_depth": self.waiting, "in_flight": self.in_flight,
+                "max_workers": self.max_workers, "max_queue": self.max_queue,
+                "shed": dict(shed_counts[self.name])}
+
+
+class KeyedRateLimiter:
+    """One token bucket per key (session ID, client address), least recently used keys evicted"""
+
+    def __init__(self, name: str, requests_per_minute: int, max_keys: int = rate_limit_max_keys):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, key: str, lane: str, cost: int = 1):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.requests_per_minute)
+                while len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+        wait_s = bucket.try_acquire(cost)
+        if wait_s:
+            _shed(lane, f"{self.name}_rate")
+            _reject(429, f"Rate limit exceeded for this {self.name}", wait_s)
+
+
+lanes = {name: AdmissionLane(name, **limits) for name, limits in admission_lanes.items()}
+shed_counts = {name: {} for name in lanes}
+session_limiter = KeyedRateLimiter("session", session_queries_per_minute)
+client_limiter = KeyedRateLimiter("client", client_requests_per_minute)
+
+
+def admission_stats() -> dict:
+    """Queue depth, in-flight requests and shed counts per lane"""
+    return {name: lane.snapshot() for name, lane in lanes.items()}
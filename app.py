@@ -1,18 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from typing import Annotated
+from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
+from contextlib import AsyncExitStack
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel
-from config import llm, hyde_embedding
+from config import llm
 from document_process import DocumentProcessor
 from rag_pipeline import RAG_Pipeline
 from postRetrievalReranker import ReRanker_Model
-from config import hf_reranker_encoder
+from config import hf_reranker_encoder, batch_max_queries
+from fastapi.concurrency import run_in_threadpool
+from admission import lanes, session_limiter, client_limiter, admission_stats
+from upload_stream import stream_upload_to_disk, check_content_length
+import json
+import uuid
 import os
+import time
 from typing import Optional
 from session_manager import SessionManager
 
+DEFAULT_SESSION_ID = "default_session"
+
 class QueryRequest(BaseModel): 
     query: str
-    session_id: Optional[str] = "default_session"  
+    session_id: Optional[str] = DEFAULT_SESSION_ID
+    include_timings: Optional[bool] = False
+    deadline_ms: Optional[int] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
 
 
 #initializing fastapi
@@ -36,50 +53,126 @@ async def root():
         "message": "Welcome to the Advanced Research Assistant",
         "endpoints": {
             "POST /upload_file": "Upload a document for processing",
-            "POST /query": "Query the uploaded documents"
+            "POST /query": "Query the uploaded documents",
+            "POST /query/stream": "Query with sources and answer tokens streamed as NDJSON events",
+            "POST /query/batch": "Answer many independent queries in one call",
+            "GET /metrics": "Prometheus metrics",
+            "GET /admission": "Queue depth, in-flight requests and shed counts per lane",
+            "GET /retrieval_stats": "How often weak first-pass retrievals escalated to HyDE"
         }
     }
 
     
+def ingestion_stats() -> dict:
+    stats = document_processor.get_statistics()
+    return {
+        "documents": stats["processed_documents"],
+        "passages": stats["child_passages"],
+        "duplicate_passages_removed": stats["duplicate_passages_removed"],
+        "boilerplate_lines_removed": stats["boilerplate_lines_removed"],
+        "tables": stats["extracted_tables"],
+        "images": stats["extracted_images"]
+    }
+
+
+def client_key(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def check_query_rate(request: Request, query: QueryRequest):
+    """
+    Session bucket first, so a query refused there costs no client token. Queries without
+    their own session ID share "default_session" across callers and are only client-limited
+    """
+    if query.session_id and query.session_id != DEFAULT_SESSION_ID:
+        session_limiter.check(f"{client_key(request)}:{query.session_id}", "query")
+    client_limiter.check(client_key(request), "query")
+
+
+def query_metadata(query: QueryRequest, result: dict) -> dict:
+    """Everything in a /query response besides the answer"""
+    body = {
+        "usage": {
+            "prompt_tokens": result.get("prompt_tokens", 0),
+            "context_tokens": result.get("context_tokens", 0)
+        }
+    }
+    if query.include_timings:
+        body["timings_ms"] = result.get("timings_ms", {})
+    if result.get("table_lookup"):
+        body["table_lookup"] = result["table_lookup"]
+    if query.deadline_ms is not None:
+        body["degradations"] = result.get("degradations", [])
+        body["deadline_exceeded"] = result.get("deadline_exceeded", False)
+    return body
+
+
+def remaining_deadline_ms(query: QueryRequest, queued_at: float):
+    """Time spent queued counts against the caller's budget"""
+    if query.deadline_ms is None:
+        return None
+    return max(1, query.deadline_ms - int((time.perf_counter() - queued_at) * 1000))
+
+
+def index_document(temp_file_path: str, content_hash: str):
+    """
+    Parse, chunk and index a PDF, then publish it (runs in a worker thread). Everything is
+    built off to the side, so a failed upload leaves the previous document fully in place
+    and running queries finish on the snapshot they started with
+    """
+    # Sections, child passages, table store and hybrid retriever, as one snapshot
+    indexed = document_processor.build_index(temp_file_path, content_hash)
+    if not indexed.retriever:
+        raise HTTPException(status_code=500, detail="Vectorstore initialization failed")
+
+    rag_pipeline.set_reranker(reranker)
+    rag_pipeline.set_document_processor(document_processor)
+
+    # Create RAG chain
+    rag_chain = rag_pipeline.create_rag_chain()
+    conversational_chain = rag_pipeline.create_conversational_chain(rag_chain, session_manager.get_session_history)
+
+    # Verify state
+    if not conversational_chain:
+        raise HTTPException(status_code=500, detail="Failed to initialize RAG pipeline components")
+
+    document_processor.publish(indexed)
+    rag_pipeline.clear_summary_cache()
+
+
 ## API endpoint for uplaoding docs
-@app.post('/upload_file')
-async def upload_file(file: Annotated[UploadFile, File(description="Upload a text document to process")]): 
+## The multipart body is parsed from request.stream() (not a File() parameter, which FastAPI
+## would receive in full before the handler runs), so limits apply before and while reading
+@app.post('/upload_file', openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {
+    "schema": {"type": "object", "required": ["file"],
+               "properties": {"file": {"type": "string", "format": "binary",
+                                       "description": "Upload a text document to process"}}}}}}})
+async def upload_file(request: Request):
     temp_file_path = None
+    ingestion = lanes["ingestion"]
     try:
+        # Shed before reading the body
+        client_limiter.check(client_key(request), ingestion.name)
+        ingestion.check_capacity()
+        check_content_length(request)
+
         if not os.path.exists("temp"):
             os.makedirs("temp")
 
-        temp_file_path = os.path.join("temp", f"temp_{file.filename}")
-        with open(temp_file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Load and process document
-        docs = document_processor.load_and_process_pdf(temp_file_path)
-
-        # Create retrievers
-        semantic_retriever, syntactic_retriever = document_processor.create_retrievers(docs)
-        hybrid_retriever = rag_pipeline.create_hybrid_retriever(syntactic_retriever, semantic_retriever)
-        
-        compression_retriever = reranker.create_compression_retriever(hybrid_retriever)
-        
-        rag_pipeline.set_compression_retriever(compression_retriever)
-        rag_pipeline.set_document_processor(document_processor)
-       
-        # Update vectorstore
-        if document_processor.vectorstore:
-            rag_pipeline.update_vectorstore(document_processor.vectorstore)
-        else:
-            raise HTTPException(status_code=500, detail="Vectorstore initialization failed")
-        
-        # Create RAG chain
-        rag_chain = rag_pipeline.create_rag_chain(compression_retriever)
-        conversational_chain = rag_pipeline.create_conversational_chain(rag_chain, session_manager.get_session_history)
-        rag_pipeline.conversational_rag = conversational_chain
-
-        # Verify state
-        if not rag_pipeline.vectorstore or not rag_pipeline.hybrid_retriever or not rag_pipeline.conversational_rag:
-            raise HTTPException(status_code=500, detail="Failed to initialize RAG pipeline components")
+        # Unique path per upload so concurrent uploads of the same filename don't clobber each other
+        temp_file_path = os.path.join("temp", f"upload_{uuid.uuid4().hex}.pdf")
+        content_hash = await stream_upload_to_disk(request, temp_file_path)
+
+        async with ingestion.slot():
+            # Same PDF as the one already indexed: nothing to do
+            if content_hash == document_processor.content_hash and rag_pipeline.conversational_rag:
+                os.remove(temp_file_path)
+                return {
+                    "message": "File already ingested; existing retriever reused.",
+                    "stats": ingestion_stats()
+                }
+
+            await run_in_threadpool(index_document, temp_file_path, content_hash)
 
         # Cleanup
         if temp_file_path and os.path.exists(temp_file_path):
@@ -87,11 +180,7 @@ async def upload_file(file: Annotated[UploadFile, File(description="Upload a tex
 
         return {
             "message": f"File uploaded and retriever initialized successfully.",
-            "stats": {
-                "documents": len(docs),
-                "tables": len(document_processor.extracted_tables),
-                "images": len(document_processor.extracted_images) if hasattr(document_processor, 'extracted_images') else 0
-            }
+            "stats": ingestion_stats()
         }
     
     except HTTPException as he:
@@ -106,29 +195,108 @@ async def upload_file(file: Annotated[UploadFile, File(description="Upload a tex
 
 ## API endpoint for querying the retriever
 @app.post('/query')
-async def query_rag(query: QueryRequest):
+async def query_rag(request: Request, query: QueryRequest):
     try:
-        result = rag_pipeline.query(query.query, query.session_id)
-        return {"response": result}
+        if query.deadline_ms is not None and query.deadline_ms <= 0:
+            raise HTTPException(status_code=400, detail="deadline_ms must be positive")
+        check_query_rate(request, query)
+
+        queued_at = time.perf_counter()
+        async with lanes["query"].slot():
+            deadline_ms = remaining_deadline_ms(query, queued_at)
+            result = await run_in_threadpool(rag_pipeline.query, query.query, query.session_id, deadline_ms)
+        return {"response": result["answer"], **query_metadata(query, result)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
 
+## Streaming variant of /query: one JSON event per line ("sources", "token"..., then "done" or "error")
+@app.post('/query/stream')
+async def query_rag_stream(request: Request, query: QueryRequest):
+    if query.deadline_ms is not None and query.deadline_ms <= 0:
+        raise HTTPException(status_code=400, detail="deadline_ms must be positive")
+    check_query_rate(request, query)
+
+    # The worker slot is taken before the response starts, so shedding is still a 503/429,
+    # and is held until the last event is sent
+    slot = AsyncExitStack()
+    queued_at = time.perf_counter()
+    await slot.enter_async_context(lanes["query"].slot())
+    deadline_ms = remaining_deadline_ms(query, queued_at)
+
+    async def events():
+        try:
+            async for event in iterate_in_threadpool(
+                rag_pipeline.query_stream(query.query, query.session_id, deadline_ms)
+            ):
+                if event["event"] == "done":
+                    event = {"event": "done", **query_metadata(query, event)}
+                yield json.dumps(event) + "\n"
+        finally:
+            await slot.aclose()
+
+    # The background task also releases the slot if the client left before the first event
+    return StreamingResponse(events(), media_type="application/x-ndjson",
+                             background=BackgroundTask(slot.aclose))
+
+
+
+## API endpoint for answering many independent queries at once
+@app.post('/query/batch')
+async def query_batch(request: Request, batch: BatchQueryRequest):
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="No queries provided")
+    if len(batch.queries) > batch_max_queries:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {batch_max_queries} queries")
+    if not rag_pipeline.retriever:
+        raise HTTPException(status_code=400, detail="No document uploaded")
+    # Each query in the batch counts against the client's rate limit
+    client_limiter.check(client_key(request), "query", cost=len(batch.queries))
+    try:
+        async with lanes["query"].slot():
+            results = await run_in_threadpool(rag_pipeline.query_batch, batch.queries)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {str(e)}")
+
+
+
+## Prometheus scrape endpoint (stage latency histograms, cache hits, LLM tokens)
+@app.get('/metrics')
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+## Admission control state (also exported as rag_admission_* metrics)
+@app.get('/admission')
+async def admission():
+    return admission_stats()
+
+
+## HyDE escalation rate and gate decisions (also exported as rag_hyde_decisions_total)
+@app.get('/retrieval_stats')
+async def retrieval_stats():
+    return {"hyde": rag_pipeline.hyde_stats()}
+
+
 
 @app.delete('/delete')
 async def deletevectorstore():
     """Clear vectorstore and session state"""
     try:
-        rag_pipeline.vectorstore = None
-        document_processor.vectorstore = None
-        rag_pipeline.hybrid_retriever = None
-        rag_pipeline.compression_retriever = None  
-        rag_pipeline.conversational_rag = None  
-        if hasattr(document_processor, 'extracted_tables'):
-            document_processor.extracted_tables = []
-        if hasattr(document_processor, 'extracted_images'):
-            document_processor.extracted_images = []
-        session_manager.clear_all_sessions()
+        # Serialized with uploads in the ingestion lane; the document goes in one publish,
+        # and queries already running finish on the snapshot they pinned
+        async with lanes["ingestion"].slot():
+            document_processor.publish(None)
+            rag_pipeline.conversational_rag = None
+            rag_pipeline.clear_summary_cache()
+            session_manager.clear_all_sessions()
         return {"message": "Vectorstore and sessions cleared"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing vectorstore: {str(e)}")
@@ -0,0 +1,158 @@
+from collections import Counter
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+
+def bm25_tokenize(text: str) -> list:
+    return text.lower().split()
+
+
+def build_faiss_index(vectors: np.ndarray):
+    """Exact L2 index over precomputed vectors; row i is chunk i"""
+    import faiss
+
+    faiss_index = faiss.IndexFlatL2(vectors.shape[1])
+    faiss_index.add(vectors)
+    return faiss_index
+
+
+def rank_agreement(bm25_ids: list, faiss_ids: list) -> float:
+    """Overlap of the BM25 and FAISS top-k lists (0 = disjoint, 1 = same passages)"""
+    depth = max(len(bm25_ids), len(faiss_ids))
+    return len(set(bm25_ids) & set(faiss_ids)) / depth if depth else 0.0
+
+
+def fuse_rankings(ranked_lists, weights, rrf_c: int = 60) -> list:
+    """Weighted reciprocal rank fusion over chunk IDs"""
+    scores = {}
+    for ids, weight in zip(ranked_lists, weights):
+        for rank, chunk_id in enumerate(ids, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (rank + rrf_c)
+    return sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+
+
+class BatchHybridRetriever:
+    """
+    Hybrid BM25 + FAISS retrieval over chunk IDs (weighted reciprocal rank fusion,
+    as LangChain's EnsembleRetriever does). Embeds, scores and searches a whole
+    batch of queries with matrix operations; single queries are a batch of one
+    """
+
+    def __init__(self, faiss_index, bm25, embeddings, k: int = 5,
+                 weights=(0.5, 0.5), rrf_c: int = 60):
+        self.faiss_index = faiss_index
+        self.embeddings = embeddings
+        self.k = k
+        self.weights = weights
+        self.rrf_c = rrf_c
+        self._build_bm25_postings(bm25)
+
+    @classmethod
+    def build(cls, texts: list, vectors: np.ndarray, embeddings, k: int = 5) -> "BatchHybridRetriever":
+        """FAISS index over precomputed passage vectors plus BM25 over their texts; row i is chunk i"""
+        # Only the BM25 term statistics are kept
+        bm25 = BM25Okapi([bm25_tokenize(text) for text in texts])
+        return cls(build_faiss_index(vectors), bm25, embeddings, k=k)
+
+    def _build_bm25_postings(self, bm25):
+        """Precompute each term's sparse postings (chunk IDs, BM25 weights) from a fitted BM25Okapi"""
+        doc_len = np.asarray(bm25.doc_len, dtype=np.float32)
+        norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+        self._n_docs = len(doc_len)
+
+        postings = {}
+        for doc_idx, freqs in enumerate(bm25.doc_freqs):
+            for term, tf in freqs.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_idx)
+                postings[term][1].append(tf)
+        self._bm25_postings = {}
+        for term, (idx, tf) in postings.items():
+            idx = np.asarray(idx, dtype=np.int64)
+            tf = np.asarray(tf, dtype=np.float32)
+            idf = bm25.idf.get(term) or 0
+            self._bm25_postings[term] = (idx, idf * tf * (bm25.k1 + 1) / (tf + norm[idx]))
+
+    def _bm25_scored(self, queries):
+        """
+        Top-k BM25 chunks per query, scatter-adding the postings of its terms into one
+        reused score vector, so memory stays O(chunks) whatever the batch size. Chunks
+        sharing no term with a query score 0 and are not returned
+        """
+        results = []
+        scores = np.zeros(self._n_docs, dtype=np.float32)
+        for query in queries:
+            touched = False
+            for term, count in Counter(bm25_tokenize(query)).items():
+                posting = self._bm25_postings.get(term)
+                if posting is None:
+                    continue
+                idx, weights = posting
+                # Chunk IDs are unique within a posting list, so fancy-index += is exact
+                scores[idx] += count * weights
+                touched = True
+            if not touched:
+                results.append(([], []))
+                continue
+
+            # A linear scan of the score vector is cheaper than sorting the touched IDs
+            candidates = np.flatnonzero(scores)
+            candidate_scores = scores[candidates]
+            scores[candidates] = 0
+            if len(candidates) > self.k:
+                # Everything scoring at least the k-th best, so ties at the cut are decided below
+                kth = np.partition(candidate_scores, len(candidates) - self.k)[len(candidates) - self.k]
+                keep = candidate_scores >= kth
+                candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+            # Best first; ties go to the higher chunk ID, as the previous descending argsort did
+            order = np.lexsort((-candidates, -candidate_scores))[:self.k]
+            results.append((candidates[order].tolist(), candidate_scores[order].tolist()))
+        return results
+
+    def _bm25_batch(self, queries):
+        return [ids for ids, _ in self._bm25_scored(queries)]
+
+    def _faiss_scored(self, query_vectors):
+        """Search the FAISS index for all query vectors in one call, with L2 distances"""
+        distances, indices = self.faiss_index.search(query_vectors, self.k)
+        return [([int(i) for i in row if i != -1], [float(d) for i, d in zip(row, dists) if i != -1])
+                for row, dists in zip(indices, distances)]
+
+    def _faiss_batch(self, query_vectors):
+        return [ids for ids, _ in self._faiss_scored(query_vectors)]
+
+    def _fuse(self, ranked_lists):
+        return fuse_rankings(ranked_lists, self.weights, self.rrf_c)
+
+    def search(self, queries: list, query_vectors: np.ndarray) -> list:
+        """
+        Per query, the unfused ((BM25 IDs, scores), (FAISS IDs, L2 distances)) top-k lists,
+        so results from several shards can be merged before fusion
+        """
+        return list(zip(self._bm25_scored(queries), self._faiss_scored(query_vectors)))
+
+    def retrieve_with_agreement(self, queries: list, query_vectors=None) -> list:
+        """
+        (fused candidate IDs, BM25/FAISS agreement) for each query, in input order.
+        query_vectors replaces embedding the queries (e.g. HyDE vectors)
+        """
+        if not queries:
+            return []
+        if query_vectors is None:
+            query_vectors = self.embeddings.embed_documents(queries)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        syntactic = self._bm25_batch(queries)
+        semantic = self._faiss_batch(query_vectors)
+        return [(self._fuse([bm25_ids, faiss_ids]), rank_agreement(bm25_ids, faiss_ids))
+                for bm25_ids, faiss_ids in zip(syntactic, semantic)]
+
+    def retrieve(self, queries: list) -> list:
+        """Return fused BM25 + FAISS candidate IDs for each query, in input order"""
+        return [ids for ids, _ in self.retrieve_with_agreement(queries)]
+
+    def invoke(self, query: str) -> list:
+        return self.retrieve([query])[0]
+
+    def close(self):
+        """Nothing to release in-process (see ShardedRetriever)"""
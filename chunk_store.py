@@ -0,0 +1,150 @@
+import sys
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Bit flags per chunk
+HAS_TABLES = 1
+HAS_IMAGES = 2
+
+KINDS = ("text", "table", "image")
+
+
+class ChunkStoreBuilder:
+    """Collects chunks one at a time, then freezes them into a ChunkStore"""
+
+    def __init__(self):
+        self._texts = []
+        self._pages = []
+        self._flags = []
+        self._parents = []
+        self._kinds = []
+        self._table_counts = []
+        self._image_counts = []
+        self._tables = []
+        self._image_base64 = []
+        self._image_descriptions = []
+
+    def add(self, text: str, page_number=None, tables=(), images=(), parent_id: int = -1, kind: str = "text") -> int:
+        """Append a chunk and return its integer ID. images are {"base64", "description"} dicts"""
+        chunk_id = len(self._texts)
+        self._texts.append(text or "")
+        self._pages.append(page_number if page_number is not None else -1)
+        self._flags.append((HAS_TABLES if tables else 0) | (HAS_IMAGES if images else 0))
+        self._parents.append(parent_id)
+        self._kinds.append(KINDS.index(kind))
+        self._table_counts.append(len(tables))
+        self._image_counts.append(len(images))
+        self._tables.extend(tables)
+        for img in images:
+            self._image_base64.append(img.get("base64"))
+            self._image_descriptions.append(img.get("description"))
+        return chunk_id
+
+    def build(self) -> "ChunkStore":
+        return ChunkStore(
+            text_buffer="".join(self._texts),
+            offsets=_prefix_sum([len(t) for t in self._texts]),
+            pages=np.asarray(self._pages, dtype=np.int32),
+            flags=np.asarray(self._flags, dtype=np.uint8),
+            parent_ids=np.asarray(self._parents, dtype=np.int32),
+            kinds=np.asarray(self._kinds, dtype=np.uint8),
+            table_ptr=_prefix_sum(self._table_counts),
+            tables=self._tables,
+            image_ptr=_prefix_sum(self._image_counts),
+            image_base64=self._image_base64,
+            image_descriptions=self._image_descriptions,
+        )
+
+
+def _prefix_sum(counts) -> np.ndarray:
+    ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    return ptr
+
+
+class ChunkStore:
+    """
+    Columnar chunk storage addressed by integer ID: all text lives in one buffer
+    sliced by offsets, per-chunk fields are NumPy arrays, and tables/images sit in
+    side tables indexed by CSR-style pointers. Documents are only built on request.
+    """
+
+    def __init__(self, text_buffer, offsets, pages, flags, parent_ids, kinds,
+                 table_ptr, tables, image_ptr, image_base64, image_descriptions):
+        self.text_buffer = text_buffer
+        self.offsets = offsets
+        self.pages = pages
+        self.flags = flags
+        self.parent_ids = parent_ids
+        self.kinds = kinds
+        self.table_ptr = table_ptr
+        self.tables = tables
+        self.image_ptr = image_ptr
+        self.image_base64 = image_base64
+        self.image_descriptions = image_descriptions
+        # Owning chunk of each side-table row
+        self.table_chunk = np.repeat(np.arange(len(pages), dtype=np.int32), np.diff(table_ptr))
+        self.image_chunk = np.repeat(np.arange(len(pages), dtype=np.int32), np.diff(image_ptr))
+
+    def __len__(self):
+        return len(self.pages)
+
+    def text(self, chunk_id: int) -> str:
+        return self.text_buffer[self.offsets[chunk_id]:self.offsets[chunk_id + 1]]
+
+    def texts(self, chunk_ids=None) -> list:
+        if chunk_ids is None:
+            chunk_ids = range(len(self))
+        return [self.text(i) for i in chunk_ids]
+
+    def page(self, chunk_id: int):
+        page = int(self.pages[chunk_id])
+        return page if page >= 0 else None
+
+    def kind(self, chunk_id: int) -> str:
+        return KINDS[self.kinds[chunk_id]]
+
+    def tables_of(self, chunk_id: int) -> list:
+        return self.tables[self.table_ptr[chunk_id]:self.table_ptr[chunk_id + 1]]
+
+    def images_of(self, chunk_id: int) -> list:
+        start, end = self.image_ptr[chunk_id], self.image_ptr[chunk_id + 1]
+        return [{"base64": self.image_base64[i], "description": self.image_descriptions[i]}
+                for i in range(start, end)]
+
+    def table_record(self, table_idx: int) -> dict:
+        chunk_id = int(self.table_chunk[table_idx])
+        html = self.tables[table_idx]
+        return {"content": html, "html": html, "page_number": self.page(chunk_id),
+                "chunk_id": chunk_id, "source": "pdf"}
+
+    def image_record(self, image_idx: int) -> dict:
+        chunk_id = int(self.image_chunk[image_idx])
+        return {"content": "[IMAGE BASE64]", "base64": self.image_base64[image_idx],
+                "description": self.image_descriptions[image_idx],
+                "page_number": self.page(chunk_id), "chunk_id": chunk_id, "source": "image"}
+
+    def document(self, chunk_id: int, **metadata) -> Document:
+        """Materialize one chunk as a LangChain Document (used for the final context only)"""
+        flags = int(self.flags[chunk_id])
+        return Document(
+            page_content=self.text(chunk_id),
+            metadata={
+                "source": "pdf",
+                "chunk_id": int(chunk_id),
+                "page_number": self.page(chunk_id),
+                "has_tables": bool(flags & HAS_TABLES),
+                "original_tables": self.tables_of(chunk_id),
+                "has_images": bool(flags & HAS_IMAGES),
+                "original_images": self.images_of(chunk_id),
+                **metadata,
+            },
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate footprint of the text buffer and arrays (side-table strings excluded)"""
+        arrays = (self.offsets, self.pages, self.flags, self.parent_ids, self.kinds,
+                  self.table_ptr, self.image_ptr, self.table_chunk, self.image_chunk)
+        return sys.getsizeof(self.text_buffer) + sum(a.nbytes for a in arrays)
@@ -1,37 +1,72 @@
-from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.chains import HypotheticalDocumentEmbedder
-import torch
-from groq import Groq
+import httpx
 
 import os
 from dotenv import load_dotenv
+from lazy_loading import LazyObject, resolve
 load_dotenv()
 
 
 ## for increased efficiency
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
-torch.set_num_threads(4)
 
 
 groq_api_key = os.getenv("GROQ_API_KEY")
 
 ##############################################################################################
 
-hf_embeddings = HuggingFaceEmbeddings(
-    model_name = "BAAI/bge-small-en-v1.5",
-    encode_kwargs = {'normalize_embeddings':True},
-)   
+## Models and clients are LazyObjects: torch, sentence-transformers and the Groq SDK are only
+## imported when a worker first uses them, so importing app.py stays cheap
+def _bge_embeddings():
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    torch.set_num_threads(4)
+    return HuggingFaceEmbeddings(
+        model_name = "BAAI/bge-small-en-v1.5",
+        encode_kwargs = {'normalize_embeddings':True},
+    )
 
-llm = ChatGroq(model="openai/gpt-oss-20b", 
-               groq_api_key=groq_api_key)
 
-llm_summarize = ChatGroq(model="llama-3.1-70b-versatile", 
-               groq_api_key=groq_api_key)
+def _chat_model(model: str):
+    from langchain_groq import ChatGroq
+    return ChatGroq(model=model,
+                    groq_api_key=groq_api_key,
+                    http_client=groq_http_client,
+                    max_retries=0)
+
+
+def _groq_client():
+    from groq import Groq
+    return Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=groq_http_client, max_retries=0)
+
+
+hf_embeddings = LazyObject(_bge_embeddings, "bge-small-en-v1.5 embeddings")
+
+## one keep-alive connection pool shared by every Groq client
+groq_http_client = httpx.Client(
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+
+## retries happen in llm_gateway (jittered backoff), so the SDK's own retries are off
+llm = LazyObject(lambda: _chat_model("openai/gpt-oss-20b"), "openai/gpt-oss-20b")
+
+llm_summarize = LazyObject(lambda: _chat_model("llama-3.1-70b-versatile"), "llama-3.1-70b-versatile")
 
 
 vision_model = "meta-llama/llama-4-scout-17b-16e-instruct"
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+groq_client = LazyObject(_groq_client, "Groq client")
+
+## per-model limits enforced by llm_gateway; calls reserve an estimate from the token bucket,
+## corrected to the provider-reported usage afterwards (tokens_per_minute None = no bucket)
+llm_rate_limits = {
+    "openai/gpt-oss-20b": {"max_concurrency": 8, "tokens_per_minute": 250_000},
+    "llama-3.1-70b-versatile": {"max_concurrency": 4, "tokens_per_minute": 60_000},
+    vision_model: {"max_concurrency": 4, "tokens_per_minute": 60_000},
+}
+default_llm_rate_limit = {"max_concurrency": 4, "tokens_per_minute": 30_000}
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+llm_backoff_base_s = 0.5
+llm_backoff_max_s = 8.0
 
 ##############################################################################################
 
@@ -40,14 +75,96 @@ hf_reranker_encoder = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
 ##############################################################################################
 
-hyde_base_embedding =  HuggingFaceEmbeddings(
-    model_name = "BAAI/bge-small-en-v1.5",
-    encode_kwargs = {'normalize_embeddings':True},
-)
+## small-to-big retrieval: ~160-token child passages are indexed, parent sections feed the prompt
+child_chunk_chars = int(os.getenv("CHILD_CHUNK_CHARS", "640"))
+child_chunk_overlap = int(os.getenv("CHILD_CHUNK_OVERLAP", "96"))
+retriever_k = int(os.getenv("RETRIEVER_K", "8"))
+rerank_top_n = int(os.getenv("RERANK_TOP_N", "6"))
+
+## structured tables: parsed once at ingestion for direct cell lookups and row/column prompt slices
+table_slice_max_rows = 8
+table_lookup_min_match = 0.6
+
+## ingestion dedup: repeated headers/footers and near-duplicate passages are dropped before embedding
+dedup_passages = os.getenv("DEDUP_PASSAGES", "true").lower() == "true"
+shingle_size = 5
+minhash_num_perm = 64
+minhash_bands = 16
+near_duplicate_threshold = 0.85
+boilerplate_min_pages = 3
+boilerplate_page_fraction = 0.3
+
+##############################################################################################
+
+## answer prompt context assembly
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+context_tokenizer = os.getenv("CONTEXT_TOKENIZER", "o200k_base")
+
+## per-query multimodal summarization fan-out
+summary_max_workers = int(os.getenv("SUMMARY_MAX_WORKERS", "3"))
+summary_timeout_s = float(os.getenv("SUMMARY_TIMEOUT_S", "6"))
+summary_fallback_chars = 600
+
+## latency budgets (QueryRequest.deadline_ms): stage cost estimates used until latencies are observed
+stage_latency_defaults_ms = {"reformulate": 700, "retrieve": 80, "hyde": 1200, "rerank": 300, "summarize": 1500,
+                             "generate": 1500}
+degraded_rerank_candidates = 4
+
+## confidence-gated HyDE: a hypothetical answer is generated, embedded and searched only when the first
+## pass looks weak (top cross-encoder logit below the threshold, or BM25/FAISS top-k overlap below it)
+hyde_enabled = os.getenv("HYDE_ENABLED", "true").lower() == "true"
+hyde_min_rerank_score = float(os.getenv("HYDE_MIN_RERANK_SCORE", "0.0"))
+hyde_min_agreement = float(os.getenv("HYDE_MIN_AGREEMENT", "0.125"))
+hyde_cache_size = int(os.getenv("HYDE_CACHE_SIZE", "1024"))
+
+## speculative retrieval: search the raw follow-up while it is being reformulated
+speculative_retrieval = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+speculative_similarity_threshold = float(os.getenv("SPECULATIVE_SIMILARITY_THRESHOLD", "0.9"))
+## one speculative search per in-flight follow-up, so by default as many as the query lane admits
+speculative_max_workers = int(os.getenv("SPECULATIVE_MAX_WORKERS", os.getenv("QUERY_MAX_WORKERS", "8")))
+
+## uploads are streamed to disk in chunks and hashed on the fly
+upload_chunk_bytes = 1024 * 1024
+upload_max_bytes = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+parsed_docs_cache_size = int(os.getenv("PARSED_DOCS_CACHE_SIZE", "4"))
+
+## admission control: bounded worker/queue lanes per traffic type and per-caller rate limits.
+## Ingestion mutates the shared index, so it runs one upload at a time
+admission_lanes = {
+    "ingestion": {"max_workers": 1, "max_queue": int(os.getenv("INGESTION_MAX_QUEUE", "4")), "queue_timeout_s": 30.0},
+    "query": {"max_workers": int(os.getenv("QUERY_MAX_WORKERS", "8")), "max_queue": int(os.getenv("QUERY_MAX_QUEUE", "64")), "queue_timeout_s": 5.0},
+}
+session_queries_per_minute = int(os.getenv("SESSION_QUERIES_PER_MINUTE", "30"))
+client_requests_per_minute = int(os.getenv("CLIENT_REQUESTS_PER_MINUTE", "120"))
+rate_limit_max_keys = 10000
+
+## sharded retrieval: passages are split across N local worker processes, each holding its own
+## FAISS + BM25 shard; queries fan out to all of them (0 or 1 keeps retrieval in-process)
+retrieval_shards = int(os.getenv("RETRIEVAL_SHARDS", "0"))
+shard_timeout_ms = float(os.getenv("SHARD_TIMEOUT_MS", "250"))
+
+## micro-batching: concurrent query-time embedding / cross-encoder calls share one model call
+inference_max_batch_size = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "64"))
+inference_max_wait_ms = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+
+## /query/batch limits
+batch_max_queries = int(os.getenv("BATCH_MAX_QUERIES", "256"))
+batch_llm_concurrency = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+##############################################################################################
+
+## same bge model as retrieval, so HyDE vectors live in the FAISS index's space (and no second copy is loaded)
+hyde_base_embedding = hf_embeddings
+
+
+def _hyde_embedding():
+    from langchain.chains import HypotheticalDocumentEmbedder
+    return HypotheticalDocumentEmbedder.from_llm(llm = resolve(llm),
+                                                 base_embeddings = resolve(hyde_base_embedding),
+                                                 prompt_key="sci_fact")
+
 
-hyde_embedding = HypotheticalDocumentEmbedder.from_llm(llm = llm, 
-                                              base_embeddings = hyde_base_embedding,
-                                              prompt_key="sci_fact")
+hyde_embedding = LazyObject(_hyde_embedding, "HyDE embedder")
 
 
 
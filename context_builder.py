@@ -0,0 +1,206 @@
+from html.parser import HTMLParser
+import tiktoken
+
+from config import context_token_budget, context_tokenizer
+
+
+class _TableTextParser(HTMLParser):
+    """Collects table cells row by row while stripping all markup"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.text = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th"):
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            if self._row is None:
+                self._row = []
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        self.text.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _parse_table(table_html: str) -> _TableTextParser:
+    parser = _TableTextParser()
+    parser.feed(table_html)
+    parser.close()
+    return parser
+
+
+def html_table_rows(table_html: str) -> list:
+    """Cell text of each non-empty table row"""
+    if not table_html or "<" not in table_html:
+        return []
+    return _parse_table(table_html).rows
+
+
+def html_table_to_text(table_html: str) -> str:
+    """Convert table HTML into compact pipe-separated rows"""
+    if not table_html:
+        return ""
+    if "<" not in table_html:
+        return " ".join(table_html.split())
+
+    parser = _parse_table(table_html)
+    if parser.rows:
+        return "\n".join(" | ".join(row) for row in parser.rows)
+    return " ".join("".join(parser.text).split())
+
+
+class ContextBuilder:
+    """
+    Assembles the answer-prompt context from reranked chunks, summaries,
+    tables and image descriptions within a fixed token budget
+    """
+
+    def __init__(self, token_budget: int = context_token_budget, encoding_name: str = context_tokenizer,
+                 min_section_tokens: int = 48):
+        self.token_budget = token_budget
+        self.min_section_tokens = min_section_tokens
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_failed = False
+
+    @property
+    def encoding(self):
+        """Load the tokenizer on first use; tiktoken downloads its BPE file the first time"""
+        if self._encoding is None and not self._encoding_failed:
+            try:
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                print(f"Tokenizer '{self.encoding_name}' unavailable ({e}), estimating 4 chars per token")
+                self._encoding_failed = True
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.encoding is None:
+            return text if len(text) <= max_tokens * 4 else text[:max_tokens * 4] + "..."
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens]) + "..."
+
+    def _collect_sections(self, docs, summaries, tables, images):
+        """Turn every context source into a scored section, dropping duplicates by chunk ID"""
+        sections = []
+        covered_chunks = set()
+        summarized_chunks = set()
+        seen = set()
+
+        # Tier 0: reranked chunks (summary if one exists, otherwise the raw text)
+        for doc in docs:
+            chunk_id = doc.metadata.get("chunk_id")
+            if chunk_id is not None and chunk_id in covered_chunks:
+                continue
+            covered_chunks.add(chunk_id)
+
+            page = doc.metadata.get("page_number", "?")
+            summary = summaries.get(chunk_id) if chunk_id is not None else None
+            if summary:
+                summarized_chunks.add(chunk_id)
+                header = f"[Page {page} | Summary]"
+                body = summary
+            else:
+                header = f"[Page {page}]"
+                body = doc.page_content
+            sections.append({
+                "tier": 0,
+                "score": doc.metadata.get("relevance_score", 0.0),
+                "chunk_id": chunk_id,
+                "page_number": doc.metadata.get("page_number"),
+                "kind": "summary" if summary else "text",
+                "text": f"{header}\n{body}",
+            })
+
+        # Tier 1: matched tables (row/column slices when parsed) not already inside a chunk summary
+        for table in tables:
+            chunk_id = table.get("chunk_id")
+            if chunk_id is not None and chunk_id in summarized_chunks:
+                continue
+            compact = table.get("slice") or html_table_to_text(table.get("html") or table.get("content", ""))
+            if not compact or ("table", compact) in seen:
+                continue
+            seen.add(("table", compact))
+            label = f"Table {table['table_number']}" if table.get("table_number") else "Table"
+            sections.append({
+                "tier": 1,
+                "score": table.get("match_score", 0.0),
+                "chunk_id": chunk_id,
+                "page_number": table.get("page_number"),
+                "kind": "table",
+                "text": f"[{label} - Page {table.get('page_number', '?')}]\n{compact}",
+            })
+
+        # Tier 2: image descriptions not already inside a chunk summary
+        for img in images:
+            chunk_id = img.get("chunk_id")
+            if chunk_id is not None and chunk_id in summarized_chunks:
+                continue
+            desc = img.get("description") or ""
+            if not desc or ("image", desc) in seen:
+                continue
+            seen.add(("image", desc))
+            sections.append({
+                "tier": 2,
+                "score": img.get("match_score", 0.0),
+                "chunk_id": chunk_id,
+                "page_number": img.get("page_number"),
+                "kind": "image",
+                "text": f"[Image - Page {img.get('page_number', '?')}]\n{desc}",
+            })
+
+        return sections
+
+    def build(self, docs, summaries=None, tables=None, images=None) -> dict:
+        """Pack deduplicated context sections by relevance into the token budget"""
+        sections = self._collect_sections(docs, summaries or {}, tables or [], images or [])
+        sections.sort(key=lambda s: (s["tier"], -s["score"]))
+
+        packed = []
+        used = 0
+        dropped = 0
+        for section in sections:
+            remaining = self.token_budget - used
+            tokens = self.count_tokens(section["text"] + "\n\n")
+            if tokens <= remaining:
+                packed.append(section)
+                used += tokens
+            elif remaining >= self.min_section_tokens:
+                section = {**section, "text": self.truncate(section["text"], remaining - 8), "truncated": True}
+                packed.append(section)
+                used += self.count_tokens(section["text"] + "\n\n")
+            else:
+                dropped += 1
+
+        return {
+            "text": "\n\n".join(s["text"] for s in packed),
+            "context_tokens": used,
+            "sections": [
+                {"chunk_id": s["chunk_id"], "page_number": s["page_number"], "kind": s["kind"],
+                 "truncated": s.get("truncated", False)}
+                for s in packed
+            ],
+            "dropped_sections": dropped,
+        }
@@ -0,0 +1,153 @@
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from config import (minhash_num_perm, minhash_bands, shingle_size, near_duplicate_threshold,
+                    boilerplate_min_pages, boilerplate_page_fraction)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed so the same PDF always dedupes the same way
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=minhash_num_perm, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=minhash_num_perm, dtype=np.uint64)
+
+
+def _normalize_line(line: str) -> str:
+    return " ".join(line.lower().split())
+
+
+def _numbered_keys(line: str) -> list:
+    """
+    (line with one standalone number replaced by "#", that number) for each number in
+    the line: "page 7 of 12" -> ("page # of 12", 7), ("page 7 of #", 12). "Table 2" or
+    "n = 120" become keys too; only the page offset test below tells them apart
+    """
+    tokens = line.split()
+    keys = []
+    for position, token in enumerate(tokens):
+        if token.isdigit():
+            keys.append((" ".join(tokens[:position] + ["#"] + tokens[position + 1:]), int(token)))
+    return keys
+
+
+def _is_boilerplate(line: str, boilerplate: dict, page) -> bool:
+    line = _normalize_line(line)
+    if line in boilerplate and boilerplate[line] is None:
+        return True
+    # A numbered line only goes when its number sits where this page's number would
+    return page is not None and any(number - page in (boilerplate.get(key) or ())
+                                    for key, number in _numbered_keys(line))
+
+
+def find_boilerplate_lines(texts: list, pages: list) -> dict:
+    """
+    Lines (running headers, footers, journal banners) repeated on many distinct pages,
+    either verbatim (-> None) or with a number that moves with the page
+    (numbered key -> allowed number - page offsets, as printed page numbers have).
+    Labels like "Table 2" or "n = 120" repeated with unrelated numbers are kept, and so
+    are bare numbers off their page's offset. Empty for documents too short to tell
+    """
+    known_pages = {p for p in pages if p is not None}
+    min_pages = max(boilerplate_min_pages, int(len(known_pages) * boilerplate_page_fraction))
+    if len(known_pages) < boilerplate_min_pages:
+        return {}
+
+    line_pages = defaultdict(set)
+    # numbered key -> (number - page) -> pages
+    offset_pages = defaultdict(lambda: defaultdict(set))
+    for text, page in zip(texts, pages):
+        if page is None:
+            continue
+        for line in text.splitlines():
+            line = _normalize_line(line)
+            # Long lines are real content even if they repeat
+            if not line or len(line) > 120:
+                continue
+            line_pages[line].add(page)
+            for key, number in _numbered_keys(line):
+                offset_pages[key][number - page].add(page)
+
+    boilerplate = {}
+    for key, by_offset in offset_pages.items():
+        offsets = frozenset(offset for offset, seen in by_offset.items() if len(seen) >= min_pages)
+        if offsets:
+            boilerplate[key] = offsets
+    # Bare numbers (counts, table cells) repeating verbatim are content, not headers
+    boilerplate.update((line, None) for line, seen in line_pages.items()
+                       if len(seen) >= min_pages and not line.isdigit())
+    return boilerplate
+
+
+def strip_lines(text: str, boilerplate: dict, page=None) -> tuple:
+    """Drop boilerplate lines from text on the given page, returns (text, lines removed); never empties a text"""
+    if not boilerplate:
+        return text, 0
+    kept = [line for line in text.splitlines() if not _is_boilerplate(line, boilerplate, page)]
+    if not any(line.strip() for line in kept):
+        return text, 0
+    return "\n".join(kept), text.count("\n") + 1 - len(kept)
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    # Digits are kept: table rows that differ only in their numbers are not duplicates
+    words = text.lower().split()
+    if len(words) <= shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in set(shingles)), dtype=np.uint64)
+
+
+def minhash_signatures(texts: list) -> np.ndarray:
+    """(len(texts), num_perm) MinHash signatures over word shingles"""
+    signatures = np.empty((len(texts), minhash_num_perm), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        # (shingles x permutations) in one shot; 32-bit hashes times 32-bit a cannot overflow
+        permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+        signatures[row] = permuted.min(axis=0)
+    return signatures
+
+
+def find_duplicates(texts: list) -> np.ndarray:
+    """
+    Boolean mask of texts that repeat an earlier one, either exactly (after
+    normalization) or approximately (MinHash Jaccard estimate >= threshold, with
+    LSH banding so only colliding pairs are compared). The first occurrence is kept
+    """
+    duplicate = np.zeros(len(texts), dtype=bool)
+    seen_exact = set()
+    for i, text in enumerate(texts):
+        key = " ".join(text.lower().split())
+        if not key or key in seen_exact:
+            duplicate[i] = True
+        seen_exact.add(key)
+
+    candidates = np.flatnonzero(~duplicate)
+    if len(candidates) < 2:
+        return duplicate
+
+    signatures = minhash_signatures([texts[i] for i in candidates])
+    rows = minhash_num_perm // minhash_bands
+    buckets = defaultdict(list)
+    for band in range(minhash_bands):
+        band_sig = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for pos in range(len(candidates)):
+            buckets[(band, band_sig[pos].tobytes())].append(pos)
+
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        members = np.asarray(members)
+        # Agreement of each member with every earlier member of the bucket
+        similarity = (signatures[members][:, None, :] == signatures[members][None, :, :]).mean(axis=2)
+        for j in range(1, len(members)):
+            if duplicate[candidates[members[j]]]:
+                continue
+            earlier = [k for k in range(j) if not duplicate[candidates[members[k]]]]
+            if earlier and similarity[j, earlier].max() >= near_duplicate_threshold:
+                duplicate[candidates[members[j]]] = True
+    return duplicate
@@ -1,133 +1,271 @@
-from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from config import hf_embeddings
+import numpy as np
+from config import hf_embeddings, parsed_docs_cache_size, child_chunk_chars, child_chunk_overlap, retriever_k
+from config import dedup_passages, retrieval_shards
+from dedup import find_boilerplate_lines, strip_lines, find_duplicates
+from context_builder import html_table_to_text
+from chunk_store import ChunkStore, ChunkStoreBuilder
+from table_store import TableStore
+from batch_retrieval import BatchHybridRetriever
+from sharded_retrieval import ShardedRetriever
+from micro_batching import query_embeddings
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from metrics import trace_stage
+import weakref
 
 from mutimodal_processor import MultimodalProcessor
 
+
+@dataclass(frozen=True)
+class IndexedDocument:
+    """
+    Everything a query reads about the ingested document. Passage and section IDs
+    only mean something inside one snapshot, so it is built as a whole and replaced
+    as a whole (DocumentProcessor.publish), never field by field
+    """
+    # Title sections (prompt context) and the child passages that are indexed
+    sections: ChunkStore
+    passages: ChunkStore
+    dedup_stats: dict
+    table_store: TableStore
+    retriever: object
+    content_hash: str = None
+
+
+# Snapshot held by the running query, so all of its stages read the same document
+_pinned_document = ContextVar("indexed_document", default=None)
+
+
 class DocumentProcessor:
     def __init__(self):
-        self.vectorstore = None
         self.multimodal_processor = MultimodalProcessor()
-        self.processed_docs = []
-        self.extracted_tables = []
-
-    def load_and_process_pdf(self, filepath: str):
-        self.processed_docs = self.multimodal_processor.load_and_process(filepath)
-        self.extracted_tables = self._extract_tables_from_docs(self.processed_docs)
-        self.extracted_images = self._extract_images_from_docs(self.processed_docs)
-        print(f"Generated {len(self.processed_docs)} enriched documents with {len(self.extracted_tables)} tables.")
+        # The published IndexedDocument (None before the first upload or after a delete)
+        self.indexed = None
+        # content hash -> (sections, passages, dedup stats, table store), so re-uploading a known PDF skips partitioning
+        self.parsed_docs_cache = OrderedDict()
+
+    def current(self) -> IndexedDocument:
+        """The snapshot pinned by the running query, else the published one"""
+        return _pinned_document.get() or self.indexed
+
+    @contextmanager
+    def pinned(self):
+        """Keep reading one snapshot inside the block, even if a new one is published meanwhile"""
+        indexed = self.current()
+        token = _pinned_document.set(indexed)
+        try:
+            yield indexed
+        finally:
+            _pinned_document.reset(token)
+
+    def publish(self, indexed):
+        """Swap in a new snapshot (or None) for new queries with a single assignment"""
+        if indexed is not None:
+            # Queries still holding the replaced snapshot keep its retriever; its shard
+            # processes are stopped once the last of them lets go
+            weakref.finalize(indexed, indexed.retriever.close)
+        self.indexed = indexed
+
+    @property
+    def passages(self):
+        indexed = self.current()
+        return indexed.passages if indexed else None
+
+    @property
+    def retriever(self):
+        indexed = self.current()
+        return indexed.retriever if indexed else None
+
+    @property
+    def content_hash(self):
+        indexed = self.current()
+        return indexed.content_hash if indexed else None
+
+    def build_index(self, filepath: str, content_hash: str = None) -> IndexedDocument:
+        """Parse, chunk and index a PDF into a new snapshot without touching the published one"""
+        parsed = self.load_and_process_pdf(filepath, content_hash)
+        return IndexedDocument(*parsed, self.create_retriever(parsed[1]), content_hash)
+
+    def load_and_process_pdf(self, filepath: str, content_hash: str = None) -> tuple:
+        """(sections, passages, dedup stats, table store) for a PDF"""
+        if content_hash and content_hash in self.parsed_docs_cache:
+            print(f"Reusing parsed chunks for {content_hash[:12]}")
+            self.parsed_docs_cache.move_to_end(content_hash)
+            parsed = self.parsed_docs_cache[content_hash]
+        else:
+            sections = self.multimodal_processor.load_and_process(filepath)
+            passages, dedup_stats = self._build_child_chunks(sections)
+            with trace_stage("parse_tables"):
+                table_store = TableStore.from_sections(sections)
+            parsed = (sections, passages, dedup_stats, table_store)
+            if content_hash:
+                self.parsed_docs_cache[content_hash] = parsed
+                while len(self.parsed_docs_cache) > parsed_docs_cache_size:
+                    self.parsed_docs_cache.popitem(last=False)
+        sections, passages, dedup_stats, table_store = parsed
+        print(f"Generated {len(sections)} enriched documents ({len(passages)} child passages) with {len(sections.tables)} tables.")
+        print(f"Removed {dedup_stats['boilerplate_lines_removed']} boilerplate lines and "
+              f"{dedup_stats['duplicate_passages_removed']} duplicate passages.")
         print("Extracted tables:")
-        for i, t in enumerate(self.extracted_tables):
-            print(i, "Page:", "Preview:", t['content'][:100])
-            
-        
+        for frame in table_store.frames:
+            print(f"Table {frame.number}", "Page:", frame.page, "Shape:", frame.shape, "Columns:", frame.headers[:6])
 
-        return self.processed_docs
-    
-    def _extract_tables_from_docs(self, docs):
-        """Extract tables from processed documents for separate indexing"""
-        extracted_tables = []
-        for doc in docs:
-            if doc.metadata.get('has_tables', False):
-                tables = doc.metadata.get('original_tables', [])
-                for table_html in tables:
-                    extracted_tables.append({
-                        'content': table_html,
-                        'html': table_html,
-                        'page_number': doc.metadata.get('page_number', 0),
-                        'source': 'pdf'
-                    })
-        
-        return extracted_tables
-    
-    def _extract_images_from_docs(self, docs):
-        """Extract images from processed documents for separate indexing"""
-        extracted_images = []
-        for doc in docs:
-            if doc.metadata.get("has_images", False):
-                imgs = doc.metadata.get("original_images", [])
-                for img in imgs:
-                    extracted_images.append({
-                        "content": "[IMAGE BASE64]",
-                        "base64":  img.get("base64"),
-                        "description": img.get("description"),
-                        "page_number": doc.metadata.get("page_number", 0),
-                        "source": "image"
-                    })
-        return extracted_images
-    
-    
-    
+        return parsed
+
+    def _build_child_chunks(self, sections: ChunkStore) -> tuple:
+        """
+        Split each title section into small passages for embedding, BM25 and reranking.
+        Tables (as compact rows) and image descriptions become children of their own.
+        Running headers/footers and exact or near-duplicate passages are dropped
+        before anything is embedded. Returns (passages, dedup stats)
+        """
+        # Ingestion-only dependency, kept out of query-worker startup
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=child_chunk_chars,
+                                                  chunk_overlap=child_chunk_overlap)
+        section_texts = sections.texts()
+        section_pages = [sections.page(i) for i in range(len(sections))]
+        boilerplate = find_boilerplate_lines(section_texts, section_pages) if dedup_passages else {}
+
+        rows = []
+        lines_removed = 0
+        for parent_id, (section_text, page) in enumerate(zip(section_texts, section_pages)):
+            section_text, removed = strip_lines(section_text, boilerplate, page)
+            lines_removed += removed
+            for text in splitter.split_text(section_text):
+                rows.append((text, page, parent_id, "text"))
+            for table_html in sections.tables_of(parent_id):
+                for text in splitter.split_text(html_table_to_text(table_html)):
+                    rows.append((text, page, parent_id, "table"))
+            for img in sections.images_of(parent_id):
+                if img.get("description"):
+                    rows.append((img["description"], page, parent_id, "image"))
 
-    def create_retrievers(self, docs):
+        duplicate = find_duplicates([row[0] for row in rows]) if dedup_passages else [False] * len(rows)
+        dedup_stats = {"boilerplate_lines_removed": lines_removed,
+                       "duplicate_passages_removed": int(sum(duplicate))}
+
+        builder = ChunkStoreBuilder()
+        for (text, page, parent_id, kind), is_duplicate in zip(rows, duplicate):
+            if not is_duplicate:
+                builder.add(text, page, parent_id=parent_id, kind=kind)
+        return builder.build(), dedup_stats
+
+    def expand_to_parents(self, ranked: list) -> list:
+        """Map ranked (passage ID, score) pairs to their parent sections, keeping each parent's best score"""
+        parent_ids = self.current().passages.parent_ids
+        parents = {}
+        for passage_id, score in ranked:
+            parents.setdefault(int(parent_ids[passage_id]), score)
+        return list(parents.items())
+
+    def materialize(self, ranked_sections: list) -> list:
+        """Build Documents for ranked (section ID, score) pairs"""
+        sections = self.current().sections
+        return [sections.document(section_id, relevance_score=float(score))
+                for section_id, score in ranked_sections]
+
+    def create_retriever(self, passages: ChunkStore):
         """
-        Creates Semantic (FAISS) and Syntactic (BM25) retrievers
+        Builds the FAISS (semantic) and BM25 (syntactic) indexes over passage IDs
+        and the hybrid retriever that fuses them. With RETRIEVAL_SHARDS > 1 the indexes
+        are split across shard processes behind a scatter-gather ShardedRetriever
         """
-        # 1. Semantic Retriever (Vector Search)
-        print("Creating vector store...")
-        self.vectorstore = FAISS.from_documents(docs, hf_embeddings)
-        semantic_retriever = self.vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5}
-        )
+        if not len(passages):
+            raise ValueError("No text could be extracted from the document")
+        texts = passages.texts()
 
-        # 2. Syntactic Retriever (Keyword Search)
-        print("Creating BM25 retriever...")
-        syntactic_retriever = BM25Retriever.from_documents(
-            documents=docs,
-            preprocess_func=lambda text: text.lower().split()
-        )
-        syntactic_retriever.k = 5
+        # Row i of the vectors is passage i
+        print("Embedding passages...")
+        with trace_stage("embed"):
+            embeddings = np.asarray(hf_embeddings.embed_documents(texts), dtype=np.float32)
 
-        return semantic_retriever, syntactic_retriever
+        # Query vectors go through the shared micro-batcher; ingestion embeds directly above
+        with trace_stage("index"):
+            if retrieval_shards > 1:
+                print(f"Starting {retrieval_shards} retrieval shards (FAISS + BM25 each)...")
+                return ShardedRetriever(texts, embeddings, query_embeddings, retrieval_shards, k=retriever_k)
+            print("Creating vector store and BM25 retriever...")
+            return BatchHybridRetriever.build(texts, embeddings, query_embeddings, k=retriever_k)
 
 
 
 
+    def find_relevant_tables(self, query: str, limit: int = 3, chunk_ids=()) -> list:
+        """
+        Return tables the query refers to (by number, header or row label, or because
+        they belong to a retrieved chunk), best first, each with a compact row/column slice
+        """
+        indexed = self.current()
+        if not indexed or not indexed.table_store:
+            return []
+
+        relevant_tables = []
+        for frame, score in indexed.table_store.rank(query, chunk_ids)[:limit]:
+            relevant_tables.append({
+                **indexed.sections.table_record(frame.table_idx),
+                'table_number': frame.number,
+                'slice': frame.slice_for(query),
+                'match_score': score,
+            })
+        return relevant_tables
+
     def get_table_context(self, query: str) -> str:
         """Extract table context relevant to the user query"""
-        if not self.extracted_tables:
-            return ""
-        
-        query_lower = query.lower()
-        relevant_tables = []
-        
-        # Find tables matching query keywords
-        query_words = [word for word in query_lower.split() if len(word) > 3]
-        
-        for table in self.extracted_tables:
-            table_content = table.get('content', '').lower()
-            if any(word in table_content for word in query_words):
-                relevant_tables.append(table)
+        relevant_tables = self.find_relevant_tables(query)
         
         if relevant_tables:
             context = "\n\n=== RELEVANT TABLES FROM DOCUMENT ===\n"
-            for i, table in enumerate(relevant_tables[:3], 1):
+            for table in relevant_tables:
                 page = table.get('page_number', 'unknown')
-                context += f"\n[Table {i} - Page {page}]\n"
-                content = table.get('content', '')
-                content = content.replace("\n", " ")
-                content = content[:400]  
-                context += f"{content}...\n"
+                context += f"\n[Table {table['table_number']} - Page {page}]\n"
+                context += f"{table['slice']}\n"
             return context
         
         return ""
-    
-    def get_image_context(self, query: str) -> str:
-        if not self.extracted_images:
-            return ""
 
-        visual_keywords = ["figure", "image", "chart", "graph", "diagram", "visual"]
+    def lookup_table_value(self, query: str):
+        """Direct cell answer for "what is X for Y in Table N", or None"""
+        indexed = self.current()
+        if not indexed or not indexed.table_store:
+            return None
+        return indexed.table_store.lookup(query)
+
+    def needs_summary(self, doc) -> bool:
+        """Images need an LLM summary; tables only when they could not be parsed into frames"""
+        if doc.metadata.get("has_images"):
+            return True
+        if doc.metadata.get("has_tables"):
+            indexed = self.current()
+            return not (indexed.table_store and indexed.table_store.covers(indexed.sections, doc.metadata.get("chunk_id")))
+        return False
 
+    def find_relevant_images(self, query: str, limit: int = 3) -> list:
+        """Return image records when the query asks about visual content"""
+        indexed = self.current()
+        if indexed is None or not indexed.sections.image_descriptions:
+            return []
+
+        visual_keywords = ["figure", "image", "chart", "graph", "diagram", "visual"]
         if not any(w in query.lower() for w in visual_keywords):
+            return []
+
+        count = min(limit, len(indexed.sections.image_descriptions))
+        return [indexed.sections.image_record(i) for i in range(count)]
+    
+    def get_image_context(self, query: str) -> str:
+        relevant_images = self.find_relevant_images(query)
+        if not relevant_images:
             return ""
 
         context = "\n\n=== IMAGE ANALYSIS ===\n"
 
-        for i, img in enumerate(self.extracted_images[:3], 1):
+        for i, img in enumerate(relevant_images, 1):
             page = img.get("page_number", "?")
             desc = img.get("description", "No analysis.")
-            desc = img.get("description", "No analysis.")
             if len(desc) > 400:
                 desc = desc[:400] + "..."
 
@@ -137,9 +275,20 @@ class DocumentProcessor:
 
     
     def get_statistics(self) -> dict:
+        indexed = self.current()
+        if indexed is None:
+            return {"processed_documents": 0, "child_passages": 0, "extracted_tables": 0, "parsed_tables": 0,
+                    "extracted_images": 0, "chunk_store_bytes": 0, "boilerplate_lines_removed": 0,
+                    "duplicate_passages_removed": 0, "vectorstore_ready": False, "retrieval_shards": 0}
+        sections = indexed.sections
         return {
-            "processed_documents": len(self.processed_docs),
-            "extracted_tables": len(self.extracted_tables),
-            "extracted_images": len(self.extracted_images) if hasattr(self, 'extracted_images') else 0,
-            "vectorstore_ready": self.vectorstore is not None
-        }
\ No newline at end of file
+            "processed_documents": len(sections),
+            "child_passages": len(indexed.passages),
+            "extracted_tables": len(sections.tables),
+            "parsed_tables": len(indexed.table_store) if indexed.table_store else 0,
+            "extracted_images": len(sections.image_descriptions),
+            "chunk_store_bytes": sections.nbytes + indexed.passages.nbytes,
+            **indexed.dedup_stats,
+            "vectorstore_ready": True,
+            "retrieval_shards": len(indexed.retriever.shards) if isinstance(indexed.retriever, ShardedRetriever) else 0,
+        }
\ No newline at end of file
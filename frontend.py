@@ -1,8 +1,10 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+import json
+import os
 import uuid
-from typing import Optional
-import io
 
 # Page configuration
 st.set_page_config(
@@ -13,7 +15,14 @@ st.set_page_config(
 )
 
 # API Configuration
-API_BASE_URL = "http://127.0.0.1:8000"  
+API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000")
+HEALTH_CHECK_TTL_S = 15
+HEALTH_CHECK_TIMEOUT_S = 2
+# (connect, read) timeouts; the read timeout applies per chunk, so streamed answers never hit it
+UPLOAD_TIMEOUT_S = (5, 300)
+QUERY_TIMEOUT_S = (5, 120)
+
+SOURCE_LABELS = {"text": "Text", "summary": "Summary", "table": "Table", "image": "Image"}
 
 # Initialize session state
 if 'session_id' not in st.session_state:
@@ -29,61 +38,124 @@ if 'uploaded_filename' not in st.session_state:
     st.session_state.uploaded_filename = ""
 
 # Helper functions
-def upload_file_to_api(file_data, filename):
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive HTTP session, shared by every rerun and browser session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def api_url() -> str:
+    """Server URL from the sidebar input (its value from the previous rerun on the first widgets)"""
+    return st.session_state.get("api_url", API_BASE_URL).rstrip("/")
+
+
+def error_detail(response) -> str:
     try:
-        files = {"file": (filename, file_data, "application/pdf")}
-        response = requests.post(f"{API_BASE_URL}/upload_file", files=files)
-        return response
-    except requests.exceptions.RequestException as e:
-        st.error(f"Connection error: {str(e)}")
-        return None
+        return response.json().get("detail", "Unknown error")
+    except ValueError:
+        return response.text or "Unknown error"
 
 
+def upload_file_to_api(uploaded_file, progress_bar):
+    """Stream the PDF to the API as multipart chunks, advancing the progress bar as bytes are sent"""
+    uploaded_file.seek(0)
+    encoder = MultipartEncoder(fields={"file": (uploaded_file.name, uploaded_file, "application/pdf")})
+    last_percent = [-1]
 
-def query_api(query_text, session_id):
-    """Send query to FastAPI endpoint"""
+    def on_progress(monitor):
+        # Called for every block sent; only redraw when the whole percentage changes
+        percent = int(100 * monitor.bytes_read / monitor.len)
+        if percent == last_percent[0]:
+            return
+        last_percent[0] = percent
+        if percent >= 100:
+            progress_bar.progress(1.0, text="Uploaded. Processing document on the server...")
+        else:
+            progress_bar.progress(percent / 100,
+                                  text=f"Uploading... {monitor.bytes_read // 1024} / {monitor.len // 1024} KB")
+
+    monitor = MultipartEncoderMonitor(encoder, on_progress)
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/query",
-            json={"query": query_text,"session_id": session_id}
+        return get_http_session().post(
+            f"{api_url()}/upload_file",
+            data=monitor,
+            headers={"Content-Type": monitor.content_type},
+            timeout=UPLOAD_TIMEOUT_S
         )
-        return response
     except requests.exceptions.RequestException as e:
         st.error(f"Connection error: {str(e)}")
         return None
 
+
+
+def stream_query(query_text, session_id):
+    """Send query to the streaming FastAPI endpoint and yield its events as they arrive"""
+    try:
+        with get_http_session().post(
+            f"{api_url()}/query/stream",
+            json={"query": query_text, "session_id": session_id},
+            stream=True,
+            timeout=QUERY_TIMEOUT_S
+        ) as response:
+            if response.status_code != 200:
+                yield {"event": "error", "detail": error_detail(response)}
+                return
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    except requests.exceptions.RequestException as e:
+        yield {"event": "error", "detail": f"Failed to connect to API: {str(e)}"}
+
 def delete_vectorstore():
     """Delete vectorstore via API"""
     try:
-        response = requests.delete(f"{API_BASE_URL}/delete")
+        response = get_http_session().delete(f"{api_url()}/delete", timeout=QUERY_TIMEOUT_S)
         return response
     except requests.exceptions.RequestException as e:
         st.error(f"Connection error: {str(e)}")
         return None
 
-def check_api_health():
-    """Check if API is running"""
+@st.cache_data(ttl=HEALTH_CHECK_TTL_S, show_spinner=False)
+def check_api_health(base_url: str) -> bool:
+    """Check if API is running; cached per URL so reruns don't each wait on a request"""
     try:
-        response = requests.get(f"{API_BASE_URL}/")
+        response = get_http_session().get(f"{base_url}/", timeout=HEALTH_CHECK_TIMEOUT_S)
         return response.status_code == 200
-    except:
+    except requests.exceptions.RequestException:
         return False
 
 
+def render_sources(sources):
+    """Collapsible list of the context sections an answer was generated from"""
+    if not sources:
+        return
+    with st.expander(f"Sources ({len(sources)})"):
+        for source in sources:
+            page = source.get("page_number")
+            line = f"- Page {page if page is not None else '?'} · {SOURCE_LABELS.get(source['kind'], source['kind'])}"
+            if source.get("truncated"):
+                line += " (truncated)"
+            st.markdown(line)
+
+
 
 # Sidebar for file upload and controls
 with st.sidebar:
     st.title("📚 Research Assistant")
     st.markdown("---")
-    
+
     # API Status Check
-    if check_api_health():
+    if check_api_health(api_url()):
         st.success("🟢 API Connected")
     else:
         st.error("🔴 API Disconnected")
         st.warning("Please make sure your FastAPI server is active")
-    
-    
+
+
     # File upload section
     st.subheader("Upload Document")
     uploaded_file = st.file_uploader(
@@ -92,38 +164,34 @@ with st.sidebar:
         help="Upload a research paper or document to analyze",
         key='file_uploader'
     )
-    
+
     if uploaded_file is not None:
         if st.button("Process Document", type="primary"):
-            with st.spinner("Uploading and processing document..."):
-                # Read file data
-                file_data = uploaded_file.read()
-                
-                # Upload to API
-                response = upload_file_to_api(file_data, uploaded_file.name)
-                
-                if response and response.status_code == 200:
-                    st.session_state.file_uploaded = True
-                    st.session_state.uploaded_filename = uploaded_file.name
-                    st.rerun()
-                    st.success(f"✅ Document ready: {st.session_state.uploaded_filename}")
-                elif response:
-                    st.error(f"Error: {response.json().get('detail', 'Unknown error')}")
-                else:
-                    st.error("Failed to connect to API")
-        
-    
+            progress_bar = st.progress(0.0, text="Uploading...")
+            response = upload_file_to_api(uploaded_file, progress_bar)
+            progress_bar.empty()
+
+            if response and response.status_code == 200:
+                st.session_state.file_uploaded = True
+                st.session_state.uploaded_filename = uploaded_file.name
+                st.rerun()
+            elif response:
+                st.error(f"Error: {error_detail(response)}")
+            else:
+                st.error("Failed to connect to API")
+
+
     st.markdown("---")
-    
+
     # Session management
     st.subheader("Chat Session")
     col1, col2 = st.columns(2)
-    
+
     with col1:
         if st.button("New Chat", help="Start a new conversation"):
             st.session_state.chat_messages = []
             st.rerun()
-    
+
     with col2:
         if st.button("Clear All", help="Clear chat and reset"):
             st.session_state.chat_messages = []
@@ -134,14 +202,14 @@ with st.sidebar:
                         st.session_state.file_uploaded = False
                         st.session_state.uploaded_filename = ""
             st.rerun()
-    
+
     # Display session info
     st.caption(f"Session: {st.session_state.session_id[:8]}...")
-    
+
     # Reset document
     if st.session_state.file_uploaded:
         st.markdown("---")
-        if st.button("Reset/Delete Vectorstore", 
+        if st.button("Reset/Delete Vectorstore",
                      help="Upload a new document"):
             delete_response = delete_vectorstore()
             if delete_response and delete_response.status_code == 200:
@@ -149,7 +217,7 @@ with st.sidebar:
                 st.session_state.uploaded_filename = ""
                 st.session_state.chat_messages = []
                 st.rerun()
-    
+
     st.markdown("---")
     st.text_input("API URL", value=API_BASE_URL, key="api_url", help="FastAPI server URL")
 
@@ -169,58 +237,55 @@ if not st.session_state.file_uploaded:
 else:
     # Chat container
     chat_container = st.container()
-    
+
     # Display chat messages
     with chat_container:
         for message in st.session_state.chat_messages:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
-    
+                render_sources(message.get("sources"))
+
     # Chat input
     if prompt := st.chat_input("Ask me anything about your document..."):
         # Add user message to chat
         st.session_state.chat_messages.append({"role": "user", "content": prompt})
-        
+
         # Display user message
         with st.chat_message("user"):
             st.markdown(prompt)
-        
-        # Generate and display assistant response
+
+        # Render the answer as it streams in: sources first, then tokens
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            
-            with st.spinner("Thinking..."):
-                # Query the API
-                response = query_api(prompt, st.session_state.session_id)
-                
-                if response and response.status_code == 200:
-                    response_data = response.json()
-                    assistant_response = response_data.get("response", "No response received")
-                    
-                    # Display response
-                    message_placeholder.markdown(assistant_response)
-                    
-                    # Add assistant response to chat
-                    st.session_state.chat_messages.append({
-                        "role": "assistant", 
-                        "content": assistant_response
-                    })
-                elif response:
-                    error_data = response.json()
-                    error_message = f"❌ Error: {error_data.get('detail', 'Unknown error')}"
-                    message_placeholder.markdown(error_message)
-                    st.session_state.chat_messages.append({
-                        "role": "assistant", 
-                        "content": error_message
-                    })
-                else:
-                    error_message = "❌ Failed to connect to API"
-                    message_placeholder.markdown(error_message)
-                    st.session_state.chat_messages.append({
-                        "role": "assistant", 
-                        "content": error_message
-                    })
-    
+            sources_container = st.container()
+            message_placeholder.markdown("_Searching the document..._")
+
+            assistant_response = ""
+            sources = []
+            for event in stream_query(prompt, st.session_state.session_id):
+                if event["event"] == "sources":
+                    sources = event["sources"]
+                    with sources_container:
+                        render_sources(sources)
+                    message_placeholder.markdown("_Generating answer..._")
+                elif event["event"] == "token":
+                    assistant_response += event["text"]
+                    message_placeholder.markdown(assistant_response + "▌")
+                elif event["event"] == "error":
+                    assistant_response = f"❌ Error: {event['detail']}"
+                    break
+
+            if not assistant_response:
+                assistant_response = "No response received"
+            message_placeholder.markdown(assistant_response)
+
+            # Add assistant response to chat
+            st.session_state.chat_messages.append({
+                "role": "assistant",
+                "content": assistant_response,
+                "sources": sources
+            })
+
     # Show helpful tips
     if len(st.session_state.chat_messages) == 0:
         st.markdown("""
@@ -231,7 +296,7 @@ else:
         - "Are there any limitations mentioned?"
         - "Can you explain the results in simple terms?"
         """)
-        
+
         # Show document info
         st.info(f"Current document: **{st.session_state.uploaded_filename}**")
 
@@ -240,6 +305,6 @@ st.markdown("---")
 st.markdown(
     "<div style='text-align: center; color: #888;'>"
     "🔬 Research Assistant RAG System | API Version | Built with FastAPI and advanced RAG methods"
-    "</div>", 
+    "</div>",
     unsafe_allow_html=True
 )
\ No newline at end of file
@@ -0,0 +1,96 @@
+import time
+from contextvars import ContextVar
+
+from config import stage_latency_defaults_ms, degraded_rerank_candidates, retriever_k
+from metrics import expected_stage_ms
+
+# Cheapest quality loss first
+DEGRADATION_ORDER = ("skip_hyde", "skip_summaries", "shrink_rerank", "skip_reformulation")
+
+# Optional stage each degradation removes (or shrinks)
+_DEGRADED_STAGE = {
+    "skip_hyde": "hyde",
+    "skip_summaries": "summarize",
+    "shrink_rerank": "rerank",
+    "skip_reformulation": "reformulate",
+}
+_SKIPPED_BY = {"hyde": "skip_hyde", "summarize": "skip_summaries", "reformulate": "skip_reformulation"}
+
+
+def _stage_cost_ms(stage: str) -> float:
+    return expected_stage_ms(stage, stage_latency_defaults_ms[stage])
+
+
+class LatencyBudget:
+    """
+    Remaining time for one query. Before each optional stage the pipeline re-plans:
+    if the estimated cost of the stages still ahead does not fit, degradations are
+    applied in DEGRADATION_ORDER until it does. Without a deadline nothing degrades.
+    """
+
+    def __init__(self, deadline_ms=None):
+        self.deadline_ms = deadline_ms
+        self.start = time.perf_counter()
+        self.degradations = []
+
+    def remaining_ms(self):
+        if self.deadline_ms is None:
+            return None
+        return self.deadline_ms - (time.perf_counter() - self.start) * 1000
+
+    def is_degraded(self, name: str) -> bool:
+        return name in self.degradations
+
+    def record(self, name: str):
+        """Note a degradation imposed outside the planner (e.g. partial retrieval)"""
+        if not self.is_degraded(name):
+            self.degradations.append(name)
+
+    def _estimate_ms(self, stages, weights=None) -> float:
+        total = 0.0
+        for stage in stages:
+            cost = _stage_cost_ms(stage) * (weights or {}).get(stage, 1.0)
+            if stage == "rerank" and self.is_degraded("shrink_rerank"):
+                # Cross-encoder cost scales with the number of candidates (up to 2k after fusion)
+                cost *= min(1.0, degraded_rerank_candidates / (2 * retriever_k))
+            elif self.is_degraded(_SKIPPED_BY.get(stage, "")):
+                cost = 0.0
+            total += cost
+        return total
+
+    def plan(self, upcoming: list, weights: dict = None):
+        """
+        Degrade until the upcoming stages (always ending in generation) fit the remaining time.
+        weights scales stages that only run for some queries (HyDE before its gate has decided)
+        """
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return
+        for name in DEGRADATION_ORDER:
+            if self._estimate_ms(upcoming, weights) <= remaining:
+                return
+            if _DEGRADED_STAGE[name] in upcoming and not self.is_degraded(name):
+                self.degradations.append(name)
+
+    def time_left_s(self, reserve_stages=("generate",)):
+        """Seconds available to the current stage, keeping room for the given later stages"""
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return None
+        return max(0.0, (remaining - self._estimate_ms(reserve_stages)) / 1000)
+
+
+_current_budget = ContextVar("latency_budget", default=None)
+
+
+def current_budget() -> LatencyBudget:
+    """The active request's budget, or an unlimited one outside budgeted queries"""
+    return _current_budget.get() or LatencyBudget()
+
+
+def set_budget(budget: LatencyBudget):
+    return _current_budget.set(budget)
+
+
+def reset_budget(token):
+    _current_budget.reset(token)
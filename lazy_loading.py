@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+class LazyObject:
+    """
+    Placeholder for an expensive object (model, API client) that is built on first
+    attribute access, so its heavy imports are only paid by workers that use it.
+    Building is thread-safe and happens once
+    """
+
+    def __init__(self, factory, name: str = None):
+        self._factory = factory
+        self._name = name or getattr(factory, "__name__", "object")
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    start = time.perf_counter()
+                    self._target = self._factory()
+                    print(f"Loaded {self._name} in {time.perf_counter() - start:.2f}s")
+        return self._target
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._target is not None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not set in __init__
+        if attr.startswith("__") or attr in ("_factory", "_name", "_target", "_lock"):
+            raise AttributeError(attr)
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<LazyObject {self._name} ({state})>"
+
+
+def resolve(obj):
+    """The real object behind a LazyObject (building it if needed), anything else unchanged"""
+    return obj._resolve() if isinstance(obj, LazyObject) else obj
@@ -0,0 +1,211 @@
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from config import llm_rate_limits, default_llm_rate_limit, llm_max_retries, llm_backoff_base_s, llm_backoff_max_s
+from metrics import record_cache, LLM_RETRIES
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at tokens_per_minute"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, amount: int = 1) -> float:
+        """Take amount tokens if available and return 0, else return the seconds until they would be"""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: int) -> float:
+        """Block until amount tokens are available; returns the amount taken"""
+        while True:
+            wait_s = self.try_acquire(amount)
+            if not wait_s:
+                return min(float(amount), self.capacity)
+            time.sleep(wait_s)
+
+    def refund(self, amount: float):
+        """Give back tokens (or take more, when negative) once a call's real cost is known"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _ModelLimiter:
+    def __init__(self, max_concurrency: int, tokens_per_minute):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        # No token bucket for models without a provider quota (local / offline stand-ins)
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, estimated_tokens: int) -> float:
+        return self.bucket.acquire(estimated_tokens) if self.bucket else 0.0
+
+    def settle(self, reserved: float, used):
+        """Replace a reservation by the tokens actually used (None: provider did not say, keep it)"""
+        if self.bucket and used is not None:
+            self.bucket.refund(reserved - used)
+
+
+def _tokens_used(result):
+    """Total tokens reported for a response: LangChain usage_metadata or an OpenAI-style usage"""
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    return getattr(getattr(result, "usage", None), "total_tokens", None)
+
+
+def _status_code(error):
+    code = getattr(error, "status_code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        code = getattr(response, "status_code", None)
+    return code
+
+
+def _is_retryable(error) -> bool:
+    code = _status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    # groq.APIConnectionError / APITimeoutError carry no status code
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """
+    Single entry point for Groq calls: identical in-flight requests (same model and
+    prompt hash) share one call, each model has a concurrency cap and a token-rate
+    limit, and 429/5xx responses are retried with jittered exponential backoff.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def configure(self, model: str, max_concurrency: int, tokens_per_minute=None):
+        """Override a model's limits; tokens_per_minute=None removes its token bucket"""
+        with self._lock:
+            self._limiters[model] = _ModelLimiter(max_concurrency, tokens_per_minute)
+
+    def _limiter(self, model: str) -> _ModelLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                limits = llm_rate_limits.get(model, default_llm_rate_limit)
+                self._limiters[model] = _ModelLimiter(limits["max_concurrency"], limits["tokens_per_minute"])
+            return self._limiters[model]
+
+    def call(self, model: str, prompt_key: str, fn, estimated_tokens: int = 1000):
+        """Run fn() under the model's limits, coalescing with an identical in-flight call"""
+        key = (model, hashlib.sha256(prompt_key.encode("utf-8")).hexdigest())
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        record_cache("llm_singleflight", not leader)
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._call_with_retry(model, fn, estimated_tokens)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _call_with_retry(self, model: str, fn, estimated_tokens: int):
+        limiter = self._limiter(model)
+        attempt = 0
+        while True:
+            reserved = limiter.reserve(estimated_tokens)
+            with limiter.semaphore:
+                try:
+                    result = fn()
+                except Exception as e:
+                    # A failed attempt is not billed, so its reservation goes back
+                    limiter.settle(reserved, 0)
+                    if attempt >= llm_max_retries or not _is_retryable(e):
+                        raise
+                    error = e
+                else:
+                    limiter.settle(reserved, _tokens_used(result))
+                    return result
+            attempt += 1
+            self._backoff(model, error, attempt)
+
+    def stream(self, model: str, fn, estimated_tokens: int = 1000):
+        """
+        Iterate the chunks of fn() under the model's limits. Streams have a single
+        consumer, so they are never coalesced, and a failure is only retried before
+        the first chunk (a retry after that would repeat output)
+        """
+        limiter = self._limiter(model)
+        attempt = 0
+        while True:
+            reserved = limiter.reserve(estimated_tokens)
+            started = False
+            used = None
+            with limiter.semaphore:
+                try:
+                    for chunk in fn():
+                        started = True
+                        # Providers report usage on the final chunk
+                        tokens = _tokens_used(chunk)
+                        if tokens:
+                            used = (used or 0) + tokens
+                        yield chunk
+                    limiter.settle(reserved, used)
+                    return
+                except Exception as e:
+                    if not started:
+                        limiter.settle(reserved, 0)
+                    if started or attempt >= llm_max_retries or not _is_retryable(e):
+                        raise
+                    error = e
+            attempt += 1
+            self._backoff(model, error, attempt)
+
+    def _backoff(self, model: str, error, attempt: int):
+        LLM_RETRIES.labels(model=model).inc()
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(llm_backoff_max_s, llm_backoff_base_s * 2 ** (attempt - 1))
+            delay *= random.uniform(0.5, 1.5)
+        time.sleep(delay)
+
+
+def estimate_tokens(prompt: str, max_output_tokens: int = 512) -> int:
+    return len(prompt) // 4 + max_output_tokens
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,124 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge, Histogram
+
+tracer = trace.get_tracer("researchpro")
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Wall time spent in each pipeline stage",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Tokens reported by the LLM provider",
+    ["model", "kind"],
+)
+
+LLM_RETRIES = Counter(
+    "rag_llm_retries_total",
+    "LLM calls retried after a 429/5xx or connection error",
+    ["model"],
+)
+
+INFERENCE_BATCH_SIZE = Histogram(
+    "rag_inference_batch_size",
+    "Items per micro-batched embedding / cross-encoder call",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth",
+    "Requests waiting for a worker slot",
+    ["lane"],
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "rag_admission_in_flight",
+    "Requests holding a worker slot",
+    ["lane"],
+)
+
+ADMISSION_SHED = Counter(
+    "rag_admission_shed_total",
+    "Requests rejected by admission control",
+    ["lane", "reason"],
+)
+
+RETRIEVAL_SHARD_FAILURES = Counter(
+    "rag_retrieval_shard_failures_total",
+    "Shard searches that timed out or failed; the query used the other shards' results",
+    ["shard", "reason"],
+)
+
+HYDE_DECISIONS = Counter(
+    "rag_hyde_decisions_total",
+    "First-pass retrievals by HyDE gate outcome (first_pass, low_rerank_score, retriever_disagreement, skipped_budget, failed)",
+    ["decision"],
+)
+
+# Per-request stage timings, only populated inside request_timer()
+_request_timings = ContextVar("request_timings", default=None)
+
+# Exponentially smoothed wall time per stage, used to plan latency budgets
+_stage_ewma_ms = {}
+_EWMA_ALPHA = 0.2
+
+
+def expected_stage_ms(stage: str, default: float) -> float:
+    return _stage_ewma_ms.get(stage, default)
+
+
+@contextmanager
+def trace_stage(stage: str, **attributes):
+    """Time a pipeline stage as a tracing span, a histogram sample and a per-request entry"""
+    start = time.perf_counter()
+    with tracer.start_as_current_span(stage, attributes=attributes):
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+            previous = _stage_ewma_ms.get(stage)
+            elapsed_ms = elapsed * 1000
+            _stage_ewma_ms[stage] = elapsed_ms if previous is None else previous + _EWMA_ALPHA * (elapsed_ms - previous)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 2)
+
+
+@contextmanager
+def request_timer():
+    """Collect a stage -> milliseconds breakdown for everything traced inside the block"""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_llm_usage(llm, message):
+    """Count prompt/completion tokens from a chat model response, if the provider reported them"""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    model = getattr(llm, "model_name", None) or type(llm).__name__
+    LLM_TOKENS.labels(model=model, kind="prompt").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(model=model, kind="completion").inc(usage.get("output_tokens", 0))
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import hf_embeddings, inference_max_batch_size, inference_max_wait_ms
+from metrics import INFERENCE_BATCH_SIZE
+
+
+class MicroBatcher:
+    """
+    Collects inference requests from concurrent callers for up to max_wait_ms (or
+    until max_batch_size items are queued), runs them as one model call on a single
+    worker thread, and hands each caller back its slice of the results. Items are
+    sorted by length inside the batch so padding stays small.
+    """
+
+    def __init__(self, name: str, fn, length_fn=len, max_batch_size: int = inference_max_batch_size,
+                 max_wait_ms: float = inference_max_wait_ms):
+        self.name = name
+        self.fn = fn
+        self.length_fn = length_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, items: list) -> list:
+        """Blocking call returning fn(items), batched with other callers' items"""
+        if not items:
+            return []
+        future = Future()
+        self._queue.put((list(items), future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait_s
+            while size < self.max_batch_size:
+                try:
+                    # Past the deadline this still drains requests that are already queued
+                    request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._execute(batch)
+
+    def _execute(self, batch):
+        flat = [item for items, _ in batch for item in items]
+        INFERENCE_BATCH_SIZE.labels(model=self.name).observe(len(flat))
+        try:
+            order = sorted(range(len(flat)), key=lambda i: self.length_fn(flat[i]))
+            sorted_results = list(self.fn([flat[i] for i in order]))
+        except Exception as e:
+            # Fail this batch's callers; the worker thread keeps serving
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        results = [None] * len(flat)
+        for position, i in enumerate(order):
+            results[i] = sorted_results[position]
+        offset = 0
+        for items, future in batch:
+            future.set_result(results[offset:offset + len(items)])
+            offset += len(items)
+
+
+class BatchedEmbeddings:
+    """Embeddings facade whose calls go through a shared MicroBatcher (query-time use)"""
+
+    def __init__(self, embeddings, name: str = "embeddings"):
+        self.embeddings = embeddings
+        # Late-bound so a lazily loaded model is not built until the first query
+        self.batcher = MicroBatcher(name, lambda texts: self.embeddings.embed_documents(texts))
+
+    def embed_documents(self, texts: list) -> list:
+        return self.batcher.submit(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.batcher.submit([text])[0]
+
+
+query_embeddings = BatchedEmbeddings(hf_embeddings)
@@ -1,11 +1,10 @@
-from unstructured.partition.pdf import partition_pdf
-from unstructured.chunking.title import chunk_by_title
-from langchain.schema import Document
 from langchain_core.messages import HumanMessage, SystemMessage
 from config import llm_summarize
 import base64
-from unstructured.documents.elements import Image as UnstructuredImage
 from config import vision_model, groq_client
+from metrics import trace_stage, record_cache, record_llm_usage
+from llm_gateway import llm_gateway, estimate_tokens
+from chunk_store import ChunkStore, ChunkStoreBuilder
 
 class MultimodalProcessor:
     def __init__(self):
@@ -15,11 +14,16 @@ class MultimodalProcessor:
         self.image_cache = {}
         
 
-    def load_and_process(self, filepath: str) -> list[Document]:
+    def load_and_process(self, filepath: str) -> ChunkStore:
+        # The partitioning stack (layout models, OCR) is imported by the first ingestion only
+        from unstructured.partition.pdf import partition_pdf
+        from unstructured.chunking.title import chunk_by_title
+
         print("Fast scan to detect table/image pages...")
-        fast_scan = partition_pdf(
-            filename=filepath,  strategy="fast", infer_table_structure=False, extract_image_block_types=None, languages=["eng"]
-        )
+        with trace_stage("partition", strategy="fast"):
+            fast_scan = partition_pdf(
+                filename=filepath,  strategy="fast", infer_table_structure=False, extract_image_block_types=None, languages=["eng"]
+            )
         pages_with_tables = set()
 
         # Detect which pages need hi_res
@@ -51,15 +55,16 @@ class MultimodalProcessor:
             elements = fast_scan
         else:
             print("Running hi_res selectively on visual pages...")
-            hi_res_elements = partition_pdf(
-                    filename=filepath,
-                    strategy="hi_res",
-                    infer_table_structure=True,
-                    extract_image_block_types=["Table", "Image", "Figure", "Graphic", "Plot"],
-                    extract_image_block_to_payload=True,
-                    languages=["eng"],
-                    page_range=",".join(str(p) for p in pages_with_tables)
-                )
+            with trace_stage("partition", strategy="hi_res"):
+                hi_res_elements = partition_pdf(
+                        filename=filepath,
+                        strategy="hi_res",
+                        infer_table_structure=True,
+                        extract_image_block_types=["Table", "Image", "Figure", "Graphic", "Plot"],
+                        extract_image_block_to_payload=True,
+                        languages=["eng"],
+                        page_range=",".join(str(p) for p in pages_with_tables)
+                    )
            
 
             # Merge
@@ -74,17 +79,16 @@ class MultimodalProcessor:
 
         # Step 3: Chunking
         print("Chunking by title...")
-        chunks = chunk_by_title(
-            elements,
-            max_characters=3000,
-            new_after_n_chars=2400,
-            combine_text_under_n_chars=500
-        )
-
-        # Step 4: Convert to Document objects 
-        processed_docs = self._convert_chunks_without_summary(chunks)
+        with trace_stage("chunk"):
+            chunks = chunk_by_title(
+                elements,
+                max_characters=3000,
+                new_after_n_chars=2400,
+                combine_text_under_n_chars=500
+            )
 
-        return processed_docs
+        # Step 4: Pack chunks into the columnar chunk store
+        return self._convert_chunks_without_summary(chunks)
     
     
 
@@ -93,6 +97,7 @@ class MultimodalProcessor:
         if len(base64_img) > 2_000_000:
             return "[Image too large to analyze]"
         
+        record_cache("image_description", base64_img in self.image_cache)
         if base64_img in self.image_cache:
             return self.image_cache[base64_img]
         
@@ -107,22 +112,27 @@ class MultimodalProcessor:
 
             image_url = f"data:{mime};base64,{base64_img}"
 
-            response = self.groq_client.chat.completions.create(
-                model=vision_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Describe this image in detail."},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url
+            response = llm_gateway.call(
+                vision_model,
+                image_url,
+                lambda: self.groq_client.chat.completions.create(
+                    model=vision_model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": "Describe this image in detail."},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": image_url
+                                    },
                                 },
-                            },
-                        ],
-                    }
-                ]
+                            ],
+                        }
+                    ]
+                ),
+                estimated_tokens=1500
             )
 
             desc = response.choices[0].message.content
@@ -138,10 +148,11 @@ class MultimodalProcessor:
 
 
 
-    def _convert_chunks_without_summary(self, chunks) -> list[Document]:
+    def _convert_chunks_without_summary(self, chunks) -> ChunkStore:
         from concurrent.futures import ThreadPoolExecutor, as_completed
+        from unstructured.documents.elements import Image as UnstructuredImage
         
-        processed_docs = []
+        builder = ChunkStoreBuilder()
         
         # Collect all images first
         all_images_to_describe = []
@@ -155,7 +166,7 @@ class MultimodalProcessor:
         # Describe all images in parallel (max 4 concurrent)
         image_descriptions = {}
         if all_images_to_describe:
-            with ThreadPoolExecutor(max_workers=4) as executor:
+            with trace_stage("describe_images"), ThreadPoolExecutor(max_workers=4) as executor:
                 futures = {
                     executor.submit(self.describe_image, img): img 
                     for img in all_images_to_describe
@@ -188,21 +199,10 @@ class MultimodalProcessor:
                                 "description": description
                             })
 
-            doc = Document(
-                page_content=text,
-                metadata={
-                    "source": "pdf",
-                    "has_tables": len(tables) > 0,
-                    "original_tables": tables,
-                    "has_images": len(images) > 0,
-                    "original_images": images,
-                    "image_description": [img["description"] for img in images],
-                    "page_number": getattr(chunk.metadata, "page_number", None),
-                },
-            )
-            processed_docs.append(doc)
+            # The chunk's position in the store is its chunk ID
+            builder.add(text, getattr(chunk.metadata, "page_number", None), tables, images)
 
-        return processed_docs
+        return builder.build()
 
     
 
@@ -236,8 +236,14 @@ class MultimodalProcessor:
         SUMMARY (direct, no formatting tags):"""
 
         try:
-            response = self.llm.invoke([HumanMessage(content=prompt)])
+            response = llm_gateway.call(
+                getattr(self.llm, "model_name", type(self.llm).__name__),
+                prompt,
+                lambda: self.llm.invoke([HumanMessage(content=prompt)]),
+                estimated_tokens=estimate_tokens(prompt)
+            )
+            record_llm_usage(self.llm, response)
             return response.content
         except Exception as e:
             print(f"Summary failed: {e}")
-            return text
\ No newline at end of file
+            return text
\ No newline at end of file
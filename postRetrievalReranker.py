@@ -1,19 +1,35 @@
-from langchain.retrievers import ContextualCompressionRetriever 
-from langchain.retrievers.document_compressors import CrossEncoderReranker
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+from config import rerank_top_n
+from lazy_loading import LazyObject
+from micro_batching import MicroBatcher
+
+
+def _cross_encoder(model_name: str):
+    from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+    return HuggingFaceCrossEncoder(model_name=model_name)
+
 
 class ReRanker_Model():
     def __init__(self, encoderModel):
-        self.rerankermodel =  HuggingFaceCrossEncoder(
-            model_name=encoderModel
-        )
-        self.compression_retriever = None
-    
-    def create_compression_retriever(self, retriever):
-        compressor = CrossEncoderReranker(model=self.rerankermodel,
-                                          top_n=3)
-        self.compression_retriever =ContextualCompressionRetriever(base_compressor=compressor, 
-                                                              base_retriever=retriever)
-        
-        return self.compression_retriever
-        
\ No newline at end of file
+        # Loaded by the first rerank, not at startup
+        self.rerankermodel = LazyObject(lambda: _cross_encoder(encoderModel), encoderModel)
+        # Pairs from concurrent queries are scored together; padding follows the longer text
+        self.scorer = MicroBatcher("cross_encoder", lambda pairs: self.rerankermodel.score(pairs),
+                                   length_fn=lambda pair: len(pair[0]) + len(pair[1]))
+
+    def rerank(self, query: str, candidate_ids: list, store, top_n: int = rerank_top_n) -> list:
+        """Cross-encoder rerank of candidate chunk IDs, returns (chunk ID, score) pairs best first"""
+        return self.rerank_batch([query], [candidate_ids], store, top_n)[0]
+
+    def rerank_batch(self, queries: list, candidates: list, store, top_n: int = rerank_top_n) -> list:
+        """Score the (query, chunk) pairs of a whole batch in one cross-encoder call"""
+        pairs = [(query, store.text(chunk_id)) for query, ids in zip(queries, candidates) for chunk_id in ids]
+        scores = self.scorer.submit(pairs)
+
+        results = []
+        offset = 0
+        for ids in candidates:
+            id_scores = scores[offset:offset + len(ids)]
+            offset += len(ids)
+            ranked = sorted(zip(ids, id_scores), key=lambda pair: pair[1], reverse=True)
+            results.append([(chunk_id, float(score)) for chunk_id, score in ranked[:top_n]])
+        return results
@@ -1,28 +1,67 @@
-from langchain.chains import RetrievalQA
-from langchain.retrievers import EnsembleRetriever
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.runnables.history import RunnableWithMessageHistory
+from context_builder import ContextBuilder
+from metrics import trace_stage, request_timer, record_cache, record_llm_usage, HYDE_DECISIONS
+from llm_gateway import llm_gateway, estimate_tokens
+from config import summary_max_workers, summary_timeout_s, summary_fallback_chars, batch_llm_concurrency
+from config import speculative_retrieval, speculative_similarity_threshold, speculative_max_workers
+from micro_batching import query_embeddings
+from config import degraded_rerank_candidates, rerank_top_n, hyde_embedding
+from config import hyde_enabled, hyde_min_rerank_score, hyde_min_agreement, hyde_cache_size
+from latency_budget import LatencyBudget, current_budget, set_budget, reset_budget
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import OrderedDict
+from contextlib import nullcontext
+import contextvars
+import queue
+import threading
 
 
 class RAG_Pipeline:
-    def __init__(self, llm , vectorstore=None):
+    def __init__(self, llm):
         self.llm = llm
-        self.vectorstore = vectorstore
-        self.hybrid_retriever = None
-        self.compression_retriever = None
+        self.reranker = None
         self.conversational_rag = None
+        self.get_session_history = None
         self.summary_cache = {}
         self.document_processor = None
+
+        # Shared pool so a timed-out summary keeps running and still fills the cache
+        self.summary_executor = ThreadPoolExecutor(max_workers=summary_max_workers,
+                                                   thread_name_prefix="summary")
+        self._summary_inflight = {}
+        self._summary_lock = threading.Lock()
+        self._summary_generation = 0
+        self.speculative_executor = ThreadPoolExecutor(max_workers=speculative_max_workers,
+                                                   thread_name_prefix="speculative")
+
+        # HyDE second stage: hypothetical-document vectors by normalized query (they do not
+        # depend on the indexed document, so the cache survives re-uploads)
+        self.hyde_embedder = hyde_embedding
+        self.hyde_cache = OrderedDict()
+        self._hyde_lock = threading.Lock()
+        self._hyde_counts = {"first_pass": 0, "low_rerank_score": 0, "retriever_disagreement": 0,
+                             "skipped_budget": 0, "failed": 0}
+        self.context_builder = ContextBuilder()
         
         self.reformulation_prompt = self.create_reformulation_prompt()
         self.answer_prompt  = self.create_answer_prompt()
+        self.generation_chain = self.create_generation_chain()
 
     def set_document_processor(self, doc_processor):
         """Store reference to document processor for table context retrieval"""
         self.document_processor = doc_processor
 
+    @property
+    def retriever(self):
+        """Hybrid retriever (passage IDs) of the document the running query reads"""
+        return self.document_processor.retriever if self.document_processor else None
+
+    def pinned_document(self):
+        """Hold one published document snapshot for a whole query, so uploads and deletes don't land mid-query"""
+        return self.document_processor.pinned() if self.document_processor else nullcontext()
+
     def create_reformulation_prompt(self):
         reform_sys_prompt = """
         You are a research question reformulator for academic document analysis.
@@ -88,7 +127,7 @@ class RAG_Pipeline:
            - Note any trends or relationships visible in the data
            - Reference the page number when citing table data
 
-        Context (includes text passages and table data):
+        Context (text passages, summaries, table rows as "cell | cell" and image descriptions, each tagged with its page):
         {context}
         """
 
@@ -101,40 +140,246 @@ class RAG_Pipeline:
         
         
     
-    def update_vectorstore(self, vectorstore):
-        self.vectorstore = vectorstore
-
-    def create_hybrid_retriever(self, syntactic_retriever, semantic_retriever):
-        self.hybrid_retriever = EnsembleRetriever(retrievers = [syntactic_retriever, semantic_retriever],
-                                             weights = [0.5,0.5])
-        return self.hybrid_retriever
-    
-    def set_compression_retriever(self, compression_retriever):
-        self.compression_retriever = compression_retriever
+    def set_reranker(self, reranker):
+        """Store the cross-encoder reranker (the retriever comes with the document snapshot)"""
+        self.reranker = reranker
     
 
 
-    def create_rag_chain(self, retriever):
-        history_aware_retriever = create_history_aware_retriever(
-            self.llm,
-            retriever,
-            self.reformulation_prompt
+    def create_generation_chain(self):
+        """Packs retrieved documents into the context and generates the answer"""
+        # Retrieved documents are packed into a single budgeted context string, so the
+        # answer prompt never sees the same chunk twice
+        return (
+            RunnablePassthrough.assign(packed_context=RunnableLambda(self.assemble_context))
+            .assign(answer=RunnableLambda(self.generate_answer))
         )
 
-        question_answer_chain = create_stuff_documents_chain(
-            self.llm,
-            self.answer_prompt
+    def _invoke_llm(self, prompt, values: dict, config=None, max_output_tokens: int = 1024):
+        """Format a prompt and send it through the shared LLM gateway"""
+        prompt_value = prompt.invoke(values)
+        prompt_text = prompt_value.to_string()
+        message = llm_gateway.call(
+            getattr(self.llm, "model_name", type(self.llm).__name__),
+            prompt_text,
+            lambda: self.llm.invoke(prompt_value.to_messages(), config=config),
+            estimated_tokens=estimate_tokens(prompt_text, max_output_tokens)
+        )
+        record_llm_usage(self.llm, message)
+        return message
+
+    def _stream_llm(self, prompt, values: dict, max_output_tokens: int = 1024):
+        """Stream a prompt's completion through the LLM gateway, yielding text chunks"""
+        prompt_value = prompt.invoke(values)
+        message = None
+        for chunk in llm_gateway.stream(
+            getattr(self.llm, "model_name", type(self.llm).__name__),
+            lambda: self.llm.stream(prompt_value.to_messages()),
+            estimated_tokens=estimate_tokens(prompt_value.to_string(), max_output_tokens)
+        ):
+            message = chunk if message is None else message + chunk
+            if chunk.content:
+                yield chunk.content
+        record_llm_usage(self.llm, message)
+
+    def generate_answer(self, inputs: dict, config=None) -> str:
+        with trace_stage("generate"):
+            message = self._invoke_llm(self.answer_prompt, {
+                "input": inputs["input"],
+                "chat_history": inputs.get("chat_history", []),
+                "context": inputs["packed_context"]["text"],
+            }, config)
+        return message.content
+
+    def reformulate(self, inputs: dict, config=None) -> str:
+        """Rewrite a follow-up into a standalone question; first turns pass through unchanged"""
+        if not inputs.get("chat_history"):
+            return inputs["input"]
+        with trace_stage("reformulate"):
+            message = self._invoke_llm(self.reformulation_prompt, inputs, config, max_output_tokens=256)
+        return message.content
+
+    def retrieve_candidates(self, query: str) -> tuple:
+        """First-pass hybrid retrieval: (candidate passage IDs, BM25/FAISS agreement)"""
+        with trace_stage("retrieve"):
+            return self.retriever.retrieve_with_agreement([query])[0]
+
+    def rerank(self, query: str, candidates: list) -> list:
+        """Cross-encoder rerank of passage IDs into (passage ID, score) pairs"""
+        budget = current_budget()
+        self._plan_before_hyde(budget, ["rerank", "summarize", "generate"])
+        if budget.is_degraded("shrink_rerank"):
+            candidates = candidates[:degraded_rerank_candidates]
+        with trace_stage("rerank"):
+            return self.reranker.rerank(query, candidates, self.document_processor.passages)
+
+    def retrieve_and_rerank(self, query: str) -> list:
+        """Run hybrid retrieval and cross-encoder reranking as separately traced stages"""
+        candidates, agreement = self.retrieve_candidates(query)
+        return self.escalate_with_hyde(query, candidates, self.rerank(query, candidates), agreement)
+
+    def _hyde_reason(self, ranked: list, agreement: float):
+        """Why the first pass looks weak, or None when it is trusted"""
+        if not ranked or ranked[0][1] < hyde_min_rerank_score:
+            return "low_rerank_score"
+        if agreement < hyde_min_agreement:
+            return "retriever_disagreement"
+        return None
+
+    def hyde_escalation_rate(self) -> float:
+        """Fraction of first passes escalated to HyDE so far"""
+        with self._hyde_lock:
+            total = sum(self._hyde_counts.values())
+            escalated = self._hyde_counts["low_rerank_score"] + self._hyde_counts["retriever_disagreement"]
+        return escalated / total if total else 0.0
+
+    def _plan_before_hyde(self, budget, upcoming: list):
+        """
+        Plan stages that run before the HyDE gate with HyDE among them, costed at the rate
+        first passes escalate, so a tight budget drops HyDE before anything in DEGRADATION_ORDER after it
+        """
+        if not hyde_enabled:
+            budget.plan(upcoming)
+            return
+        budget.plan(upcoming + ["hyde"], {"hyde": self.hyde_escalation_rate()})
+
+    def _count_hyde(self, decision: str):
+        HYDE_DECISIONS.labels(decision=decision).inc()
+        with self._hyde_lock:
+            self._hyde_counts[decision] += 1
+
+    def hypothetical_embedding(self, query: str) -> list:
+        """HyDE vector for a query (LLM-written hypothetical passage, bge-embedded), cached per normalized query"""
+        key = " ".join(query.lower().split())
+        with self._hyde_lock:
+            vector = self.hyde_cache.get(key)
+            if vector is not None:
+                self.hyde_cache.move_to_end(key)
+        record_cache("hyde", vector is not None)
+        if vector is not None:
+            return vector
+
+        vector = llm_gateway.call(
+            getattr(self.llm, "model_name", type(self.llm).__name__),
+            f"hyde:{key}",
+            lambda: self.hyde_embedder.embed_query(query),
+            estimated_tokens=estimate_tokens(query, 512)
         )
+        with self._hyde_lock:
+            self.hyde_cache[key] = vector
+            while len(self.hyde_cache) > hyde_cache_size:
+                self.hyde_cache.popitem(last=False)
+        return vector
 
-        rag_pipeline = create_retrieval_chain(
-            history_aware_retriever,
-            question_answer_chain
+    def escalate_with_hyde(self, query: str, candidates: list, ranked: list, agreement: float) -> list:
+        """
+        Second retrieval stage for weak first passes only: search with the HyDE vector
+        (BM25 still uses the query), cross-encode the passages the first pass did not
+        already score and merge them into the ranking
+        """
+        reason = self._hyde_reason(ranked, agreement) if hyde_enabled else None
+        if reason is None:
+            self._count_hyde("first_pass")
+            return ranked
+
+        budget = current_budget()
+        budget.plan(["hyde", "rerank", "summarize", "generate"])
+        if budget.is_degraded("skip_hyde"):
+            self._count_hyde("skipped_budget")
+            return ranked
+
+        try:
+            with trace_stage("hyde", reason=reason):
+                vector = self.hypothetical_embedding(query)
+                hyde_candidates, _ = self.retriever.retrieve_with_agreement([query], [vector])[0]
+        except Exception as e:
+            # HyDE only adds recall; the first pass still answers
+            print(f"HyDE retrieval failed, using first pass: {e}")
+            self._count_hyde("failed")
+            return ranked
+        self._count_hyde(reason)
+
+        scored = set(candidates)
+        new_candidates = [passage_id for passage_id in hyde_candidates if passage_id not in scored]
+        if not new_candidates:
+            return ranked
+        with trace_stage("rerank"):
+            extra = self.reranker.rerank(query, new_candidates, self.document_processor.passages)
+        return sorted(ranked + extra, key=lambda pair: pair[1], reverse=True)[:rerank_top_n]
+
+    def hyde_stats(self) -> dict:
+        """HyDE gate outcomes so far and the fraction of first passes escalated"""
+        with self._hyde_lock:
+            counts = dict(self._hyde_counts)
+            cached = len(self.hyde_cache)
+        total = sum(counts.values())
+        escalated = counts["low_rerank_score"] + counts["retriever_disagreement"]
+        return {
+            "queries": total,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / total, 4) if total else 0.0,
+            "decisions": counts,
+            "cached_embeddings": cached,
+        }
+
+    def _near_identical(self, query: str, rewritten: str) -> bool:
+        if " ".join(query.lower().split()) == " ".join(rewritten.lower().split()):
+            return True
+        with trace_stage("speculative_check"):
+            query_vec, rewritten_vec = query_embeddings.embed_documents([query, rewritten])
+        # bge embeddings are normalized, so the dot product is the cosine similarity
+        similarity = sum(a * b for a, b in zip(query_vec, rewritten_vec))
+        return similarity >= speculative_similarity_threshold
+
+    def speculative_retrieve(self, inputs: dict, config=None) -> list:
+        """
+        Start first-pass retrieval on the raw follow-up while the reformulation call is
+        in flight. If the rewrite is near-identical the speculative candidates are reused,
+        otherwise only the rewritten query is retrieved and merged in before reranking.
+        """
+        query = inputs["input"]
+        # copy_context keeps per-request timings flowing into the worker thread
+        future = self.speculative_executor.submit(
+            contextvars.copy_context().run, self.retrieve_candidates, query
         )
+        rewritten = self.reformulate(inputs, config)
+        candidates, agreement = future.result()
+
+        reused = self._near_identical(query, rewritten)
+        record_cache("speculative_retrieval", reused)
+        if not reused:
+            seen = set(candidates)
+            rewritten_candidates, agreement = self.retrieve_candidates(rewritten)
+            for passage_id in rewritten_candidates:
+                if passage_id not in seen:
+                    seen.add(passage_id)
+                    candidates.append(passage_id)
+
+        return self.escalate_with_hyde(rewritten, candidates, self.rerank(rewritten, candidates), agreement)
+
+    def history_aware_retrieve(self, inputs: dict, config=None) -> list:
+        """Reformulate follow-ups against the chat history, then retrieve and rerank"""
+        if inputs.get("chat_history"):
+            budget = current_budget()
+            self._plan_before_hyde(budget, ["reformulate", "retrieve", "rerank", "summarize", "generate"])
+            if budget.is_degraded("skip_reformulation"):
+                return self.retrieve_and_rerank(inputs["input"])
+            # First turns have nothing to reformulate, so there is nothing to overlap
+            if speculative_retrieval:
+                return self.speculative_retrieve(inputs, config)
+        return self.retrieve_and_rerank(self.reformulate(inputs, config))
+
+    def create_rag_chain(self):
+        rag_pipeline = (
+            RunnablePassthrough.assign(context=RunnableLambda(self.history_aware_retrieve))
+            | self.generation_chain
+        ).with_config(run_name="retrieval_chain")
 
         return rag_pipeline
     
     
     def create_conversational_chain(self, rag_chain, get_session_history_func):
+        self.get_session_history = get_session_history_func
         self.conversational_rag = RunnableWithMessageHistory(
             rag_chain,
             get_session_history_func,
@@ -146,61 +391,316 @@ class RAG_Pipeline:
         return self.conversational_rag
 
 
-    def query(self, question: str, session_id: str) -> str:
-        if not self.conversational_rag:
-            return "Error: Conversational chain not initialized"
+    def _summary_key(self, doc):
+        return doc.metadata.get("chunk_id", doc.metadata.get("page_number"))
 
-        try:
-            # Retrieve top-k documents
-            retrieved_docs = self.compression_retriever.get_relevant_documents(question)
-            top_k = retrieved_docs[:3]
-
-            # Summarize chunks with tables or images
-            summarized = []
-            
-            for doc in top_k:
-                page = doc.metadata.get("page_number")
-                
-                if doc.metadata.get("has_tables") or doc.metadata.get("has_images"):
-                    if page in self.summary_cache:
-                        summary = self.summary_cache[page]
-                    else: 
-                        summary = self.document_processor.multimodal_processor._generate_ai_summary(
-                            doc.page_content[:800],
-                            doc.metadata.get("original_tables", []),
-                            doc.metadata.get("original_images", [])
-                        )
-                        self.summary_cache[page] = summary
-                    
-                    if len(summary) > 600:
-                        summary = summary[:600]
-                    summarized.append(summary)
-                else:
-                    summarized.append(doc.page_content)
-
-            # Build context
-            summarized_context = "\n\n".join(summarized)
-            enhanced_input = f"{question}\n\nSUMMARIZED CONTEXT:\n{summarized_context}"
-            
-            # Inject table context
-            if self.document_processor and hasattr(self.document_processor, 'get_table_context'):
-                table_context = self.document_processor.get_table_context(question)
-                if table_context:
-                    enhanced_input += f"\n{table_context}"
-            
-            # Inject image context
-            if self.document_processor and hasattr(self.document_processor, 'get_image_context'):
-                image_context = self.document_processor.get_image_context(question)
-                if image_context:
-                    enhanced_input += f"\n{image_context}"
-
-            # Run conversational RAG chain
-            response = self.conversational_rag.invoke(
-                {"input": enhanced_input},
-                config={"configurable": {"session_id": session_id}}
+    def _get_summary(self, doc, generation) -> str:
+        """Summarize a chunk with tables/images and cache it by chunk ID"""
+        summary = self.document_processor.multimodal_processor._generate_ai_summary(
+            doc.page_content[:800],
+            doc.metadata.get("original_tables", []),
+            doc.metadata.get("original_images", [])
+        )
+        key = self._summary_key(doc)
+        with self._summary_lock:
+            # A document reset while the call was running makes the result stale
+            if generation == self._summary_generation:
+                self.summary_cache[key] = summary
+                self._summary_inflight.pop(key, None)
+        return summary
+
+    def summarize_chunks(self, docs, timeout_s: float = summary_timeout_s, generate: bool = True) -> dict:
+        """
+        Fan out summaries for uncached chunks concurrently. Calls that exceed
+        timeout_s fall back to truncated raw text for this query; with generate=False
+        only cached summaries are used.
+        """
+        summaries = {}
+        pending = {}
+        with self._summary_lock:
+            for doc in docs:
+                key = self._summary_key(doc)
+                record_cache("summary", key in self.summary_cache)
+                if key in self.summary_cache:
+                    summaries[key] = self.summary_cache[key]
+                elif not generate:
+                    summaries[key] = doc.page_content[:summary_fallback_chars]
+                elif key not in pending:
+                    future = self._summary_inflight.get(key)
+                    if future is None:
+                        future = self.summary_executor.submit(self._get_summary, doc,
+                                                              self._summary_generation)
+                        self._summary_inflight[key] = future
+                    pending[key] = (future, doc)
+
+        if not pending:
+            return summaries
+
+        wait([future for future, _ in pending.values()], timeout=timeout_s)
+        for key, (future, doc) in pending.items():
+            if future.done() and future.exception() is None:
+                summaries[key] = future.result()
+            else:
+                print(f"Summary for chunk {key} not ready after {timeout_s:.2f}s, using raw text")
+                summaries[key] = doc.page_content[:summary_fallback_chars]
+
+        return summaries
+
+    def assemble_context(self, inputs: dict) -> dict:
+        """Summarize multimodal chunks and pack chunks, tables and images into the token budget"""
+        question = inputs["input"]
+        # Retrieval and reranking work on passage IDs; only the top parent sections become Documents
+        top_k = []
+        if self.document_processor:
+            ranked_sections = self.document_processor.expand_to_parents(inputs.get("context", []))
+            top_k = self.document_processor.materialize(ranked_sections[:3])
+
+        summaries = {}
+        tables, images = [], []
+        if self.document_processor:
+            # Parsed tables reach the prompt as row/column slices, so only images and
+            # unparsed tables still need an LLM summary
+            multimodal_docs = [doc for doc in top_k if self.document_processor.needs_summary(doc)]
+            budget = current_budget()
+            budget.plan(["summarize", "generate"])
+            if budget.is_degraded("skip_summaries"):
+                summaries = self.summarize_chunks(multimodal_docs, generate=False)
+            elif multimodal_docs:
+                time_left_s = budget.time_left_s()
+                timeout_s = summary_timeout_s if time_left_s is None else min(summary_timeout_s, time_left_s)
+                with trace_stage("summarize"):
+                    summaries = self.summarize_chunks(multimodal_docs, timeout_s)
+            tables = self.document_processor.find_relevant_tables(
+                question, chunk_ids={doc.metadata.get("chunk_id") for doc in top_k})
+            images = self.document_processor.find_relevant_images(question)
+
+        with trace_stage("pack_context"):
+            packed = self.context_builder.build(top_k, summaries, tables, images)
+
+            prompt_text = self.answer_prompt.format(
+                context=packed["text"],
+                chat_history=inputs.get("chat_history", []),
+                input=question
             )
+            packed["prompt_tokens"] = self.context_builder.count_tokens(prompt_text)
+        return packed
+
+    def clear_summary_cache(self):
+        with self._summary_lock:
+            self.summary_cache = {}
+            self._summary_inflight = {}
+            self._summary_generation += 1
+
 
-            return response.get("answer", "No response generated")  
+    def answer_from_table(self, question: str, session_id: str):
+        """
+        Answer "what is X for Y in Table N" straight from the parsed table, without
+        retrieval or LLM calls. The exchange is still recorded in the session history
+        """
+        if not self.document_processor:
+            return None
+        with request_timer() as timings:
+            with trace_stage("table_lookup"):
+                hit = self.document_processor.lookup_table_value(question)
+        if not hit:
+            return None
+
+        answer = (f"According to Table {hit['table']} (page {hit['page_number']}), "
+                  f"{hit['column']} for {hit['row']} is {hit['raw']}.")
+        history = self.get_session_history(session_id)
+        history.add_user_message(question)
+        history.add_ai_message(answer)
+        return {
+            "answer": answer,
+            "prompt_tokens": 0,
+            "context_tokens": 0,
+            "timings_ms": timings,
+            "degradations": [],
+            "deadline_exceeded": False,
+            "table_lookup": hit,
+        }
+
+    def query(self, question: str, session_id: str, deadline_ms: int = None) -> dict:
+        """Answer a question in a session; with deadline_ms, optional stages degrade to fit the budget"""
+        with self.pinned_document():
+            return self._query(question, session_id, deadline_ms)
+
+    def _query(self, question: str, session_id: str, deadline_ms) -> dict:
+        if not self.conversational_rag or not self.retriever:
+            return {"answer": "Error: Conversational chain not initialized", "prompt_tokens": 0}
+
+        table_answer = self.answer_from_table(question, session_id)
+        if table_answer:
+            return table_answer
+
+        budget = LatencyBudget(deadline_ms)
+        budget_token = set_budget(budget)
+        try:
+            # Retrieval, context packing and generation all run inside the chain
+            with request_timer() as timings:
+                with trace_stage("query"):
+                    response = self.conversational_rag.invoke(
+                        {"input": question},
+                        config={"configurable": {"session_id": session_id}}
+                    )
+
+            packed = response.get("packed_context", {})
+            return {
+                "answer": response.get("answer", "No response generated"),
+                "prompt_tokens": packed.get("prompt_tokens", 0),
+                "context_tokens": packed.get("context_tokens", 0),
+                "timings_ms": timings,
+                "degradations": list(budget.degradations),
+                "deadline_exceeded": deadline_ms is not None and budget.remaining_ms() < 0,
+            }
 
         except Exception as e:
-            return f"Error processing query: {str(e)}"
+            return {"answer": f"Error processing query: {str(e)}", "prompt_tokens": 0}
+        finally:
+            reset_budget(budget_token)
+
+    def query_stream(self, question: str, session_id: str, deadline_ms: int = None):
+        """
+        query() as a stream of events for incremental rendering: "sources" once the
+        context is packed, "token" per generated chunk, then "done" (the rest of
+        query()'s result) or "error". The pipeline runs on its own thread, so the
+        per-request budget and timings stay in one context however the events are consumed
+        """
+        events = queue.Queue()
+        threading.Thread(target=self._run_stream_pinned, args=(question, session_id, deadline_ms, events.put),
+                         name="query-stream", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+
+    def _run_stream_pinned(self, question: str, session_id: str, deadline_ms, emit):
+        with self.pinned_document():
+            self._run_stream(question, session_id, deadline_ms, emit)
+
+    def _run_stream(self, question: str, session_id: str, deadline_ms, emit):
+        try:
+            if not self.conversational_rag or not self.retriever:
+                emit({"event": "error", "detail": "Conversational chain not initialized"})
+                return
+
+            table_answer = self.answer_from_table(question, session_id)
+            if table_answer:
+                hit = table_answer.pop("table_lookup")
+                emit({"event": "sources", "sources": [
+                    {"chunk_id": hit["chunk_id"], "page_number": hit["page_number"], "kind": "table", "truncated": False}
+                ]})
+                emit({"event": "token", "text": table_answer.pop("answer")})
+                emit({"event": "done", **table_answer, "table_lookup": hit})
+                return
+
+            budget = LatencyBudget(deadline_ms)
+            budget_token = set_budget(budget)
+            try:
+                with request_timer() as timings:
+                    with trace_stage("query"):
+                        history = self.get_session_history(session_id)
+                        inputs = {"input": question, "chat_history": list(history.messages)}
+                        inputs["context"] = self.history_aware_retrieve(inputs)
+                        packed = self.assemble_context(inputs)
+                        emit({"event": "sources", "sources": packed["sections"]})
+
+                        answer = []
+                        with trace_stage("generate"):
+                            for text in self._stream_llm(self.answer_prompt, {
+                                "input": question,
+                                "chat_history": inputs["chat_history"],
+                                "context": packed["text"],
+                            }):
+                                answer.append(text)
+                                emit({"event": "token", "text": text})
+
+                # Recorded once complete, as RunnableWithMessageHistory does for query()
+                history.add_user_message(question)
+                history.add_ai_message("".join(answer))
+                emit({
+                    "event": "done",
+                    "prompt_tokens": packed.get("prompt_tokens", 0),
+                    "context_tokens": packed.get("context_tokens", 0),
+                    "timings_ms": timings,
+                    "degradations": list(budget.degradations),
+                    "deadline_exceeded": deadline_ms is not None and budget.remaining_ms() < 0,
+                })
+            finally:
+                reset_budget(budget_token)
+
+        except Exception as e:
+            emit({"event": "error", "detail": f"Error processing query: {str(e)}"})
+        finally:
+            emit(None)
+
+
+    def query_batch(self, questions: list) -> list:
+        """
+        Answer independent questions without chat history. Retrieval and reranking
+        run once for the whole batch; answer generation runs with bounded concurrency.
+        Results keep input order, with a per-item error instead of a response on failure.
+        """
+        with self.pinned_document():
+            return self._query_batch(questions)
+
+    def _query_batch(self, questions: list) -> list:
+        if not self.retriever or not self.reranker:
+            return [{"index": i, "query": q, "error": "Batch retriever not initialized"}
+                    for i, q in enumerate(questions)]
+
+        results = [None] * len(questions)
+        valid = []
+        for i, question in enumerate(questions):
+            if not question or not question.strip():
+                results[i] = {"index": i, "query": question, "error": "Empty query"}
+            else:
+                valid.append(i)
+
+        if valid:
+            batch_questions = [questions[i] for i in valid]
+            try:
+                with trace_stage("batch_retrieve"):
+                    first_pass = self.retriever.retrieve_with_agreement(batch_questions)
+                candidates = [ids for ids, _ in first_pass]
+                with trace_stage("batch_rerank"):
+                    reranked = self.reranker.rerank_batch(batch_questions, candidates,
+                                                          self.document_processor.passages)
+                # Weak first passes escalate to HyDE; their LLM calls run side by side,
+                # each in a copy of this context so they read the pinned document
+                with ThreadPoolExecutor(max_workers=batch_llm_concurrency) as pool:
+                    reranked = [future.result() for future in [
+                        pool.submit(contextvars.copy_context().run, self.escalate_with_hyde,
+                                    question, question_candidates, ranked, agreement)
+                        for question, question_candidates, ranked, (_, agreement)
+                        in zip(batch_questions, candidates, reranked, first_pass)
+                    ]]
+            except Exception as e:
+                for i in valid:
+                    results[i] = {"index": i, "query": questions[i], "error": f"Retrieval failed: {str(e)}"}
+                return results
+
+            outputs = self.generation_chain.batch(
+                [{"input": q, "context": ranked, "chat_history": []}
+                 for q, ranked in zip(batch_questions, reranked)],
+                config={"max_concurrency": batch_llm_concurrency},
+                return_exceptions=True
+            )
+
+            for i, output in zip(valid, outputs):
+                if isinstance(output, Exception):
+                    results[i] = {"index": i, "query": questions[i], "error": f"Generation failed: {str(output)}"}
+                    continue
+                packed = output.get("packed_context", {})
+                results[i] = {
+                    "index": i,
+                    "query": questions[i],
+                    "response": output.get("answer", "No response generated"),
+                    "usage": {
+                        "prompt_tokens": packed.get("prompt_tokens", 0),
+                        "context_tokens": packed.get("context_tokens", 0)
+                    }
+                }
+
+        return results
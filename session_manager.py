@@ -1,5 +1,4 @@
-from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory as ChatMessageHistory
 
 
 class SessionManager:
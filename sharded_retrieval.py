@@ -0,0 +1,270 @@
+import itertools
+import multiprocessing
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from batch_retrieval import BatchHybridRetriever, bm25_tokenize, build_faiss_index, fuse_rankings, rank_agreement
+from config import shard_timeout_ms
+from latency_budget import current_budget
+from metrics import RETRIEVAL_SHARD_FAILURES, trace_stage
+
+
+def _serve_shard(conn, texts: list, vectors: np.ndarray, k: int):
+    """Shard process: build this shard's FAISS + BM25 indexes, then answer searches until closed"""
+    try:
+        bm25 = BM25Okapi([bm25_tokenize(text) for text in texts])
+        doc_counts = Counter(term for freqs in bm25.doc_freqs for term in freqs)
+        conn.send(("stats", None, (bm25.corpus_size, sum(bm25.doc_len), dict(doc_counts))))
+
+        # Score with whole-corpus IDF and average length so BM25 scores compare across shards
+        corpus_size, avgdl, global_doc_counts = conn.recv()
+        bm25.corpus_size, bm25.avgdl, bm25.idf = corpus_size, avgdl, {}
+        bm25._calc_idf(global_doc_counts)
+        retriever = BatchHybridRetriever(build_faiss_index(vectors), bm25, embeddings=None, k=k)
+    except Exception as e:
+        conn.send(("error", None, repr(e)))
+        return
+    conn.send(("ready", None, len(texts)))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, queries, query_vectors = message
+        try:
+            conn.send(("result", request_id, retriever.search(queries, query_vectors)))
+        except Exception as e:
+            conn.send(("error", request_id, repr(e)))
+
+
+class _Shard:
+    """Coordinator-side handle of one shard process; responses are matched to callers by request ID"""
+
+    def __init__(self, index: int, ctx, global_ids: np.ndarray, texts: list, vectors: np.ndarray, k: int):
+        self.index = index
+        # Local row -> global passage ID
+        self.global_ids = global_ids
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_serve_shard, args=(child_conn, texts, vectors, k),
+                                   name=f"retrieval-shard-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.alive = True
+        self._stats = Future()
+        self._ready = Future()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._receiver = threading.Thread(target=self._receive, name=f"retrieval-shard-{index}-recv", daemon=True)
+        self._receiver.start()
+
+    def _receive(self):
+        while True:
+            try:
+                kind, request_id, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if request_id is None:
+                if kind == "stats":
+                    self._stats.set_result(payload)
+                elif kind == "ready":
+                    self._ready.set_result(payload)
+                else:
+                    error = RuntimeError(f"Shard {self.index} failed to build: {payload}")
+                    for startup in (self._stats, self._ready):
+                        if not startup.done():
+                            startup.set_exception(error)
+                    break
+                continue
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            # Late answers to timed-out requests have no caller any more
+            if future is None:
+                continue
+            if kind == "result":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Shard {self.index} search failed: {payload}"))
+
+        # The process exited or was closed: fail everything still waiting on it
+        self.alive = False
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Shard {self.index} is not running"))
+        for startup in (self._stats, self._ready):
+            if not startup.done():
+                startup.set_exception(RuntimeError(f"Shard {self.index} exited during startup"))
+        if self._ready.done() and self._ready.exception() is None:
+            print(f"Retrieval shard {self.index} stopped")
+
+    def local_stats(self) -> tuple:
+        """(passages, tokens, term -> passages containing it) of this shard"""
+        return self._stats.result()
+
+    def start_serving(self, corpus_size: int, avgdl: float, doc_counts: dict):
+        with self._send_lock:
+            self.conn.send((corpus_size, avgdl, doc_counts))
+
+    def wait_ready(self, timeout_s: float = None) -> int:
+        return self._ready.result(timeout=timeout_s)
+
+    def submit(self, request_id: int, queries: list, query_vectors: np.ndarray) -> Future:
+        future = Future()
+        if not self.alive:
+            future.set_exception(RuntimeError(f"Shard {self.index} is not running"))
+            return future
+        with self._lock:
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((request_id, queries, query_vectors))
+        except (OSError, ValueError) as e:
+            self.discard(request_id)
+            future.set_exception(RuntimeError(f"Shard {self.index} is not reachable: {e}"))
+        return future
+
+    def discard(self, request_id: int):
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    def close(self):
+        try:
+            with self._send_lock:
+                self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+
+class ShardedRetriever:
+    """
+    Scatter-gather hybrid retrieval: passages are split round-robin across local worker
+    processes, each holding its own FAISS index and BM25 postings (scored with
+    whole-corpus term statistics). Query vectors are computed once here, every shard
+    returns its scored top-k, and the merged BM25 and FAISS lists are fused exactly as
+    BatchHybridRetriever does. Shards that time out or fail are left out of the merge
+    (partial results) rather than failing the query. Same interface as BatchHybridRetriever
+    """
+
+    def __init__(self, texts: list, vectors: np.ndarray, embeddings, num_shards: int, k: int = 5,
+                 weights=(0.5, 0.5), rrf_c: int = 60, timeout_ms: float = shard_timeout_ms):
+        self.embeddings = embeddings
+        self.k = k
+        self.weights = weights
+        self.rrf_c = rrf_c
+        self.timeout_s = timeout_ms / 1000
+        self._request_ids = itertools.count()
+
+        # Spawned (not forked) so shards never inherit loaded models or their threads
+        ctx = multiprocessing.get_context("spawn")
+        num_shards = min(num_shards, len(texts))
+        self.shards = []
+        for index in range(num_shards):
+            # Round-robin keeps shards alike in size
+            global_ids = np.arange(index, len(texts), num_shards)
+            self.shards.append(_Shard(index, ctx, global_ids, [texts[i] for i in global_ids],
+                                      np.ascontiguousarray(vectors[global_ids]), k))
+        try:
+            self._share_bm25_stats()
+            for shard in self.shards:
+                shard.wait_ready()
+        except Exception:
+            self.close()
+            raise
+
+    def _share_bm25_stats(self):
+        """Sum the shards' term statistics and send the totals back, as one BM25 over all passages would use"""
+        corpus_size, tokens, doc_counts = 0, 0, Counter()
+        for shard in self.shards:
+            size, length, counts = shard.local_stats()
+            corpus_size += size
+            tokens += length
+            doc_counts.update(counts)
+        for shard in self.shards:
+            shard.start_serving(corpus_size, tokens / corpus_size, dict(doc_counts))
+
+    def _gather(self, queries: list, query_vectors: np.ndarray) -> list:
+        """Fan the batch out to every shard; (shard, results) for those answering within the timeout"""
+        request_id = next(self._request_ids)
+        futures = [(shard, shard.submit(request_id, queries, query_vectors)) for shard in self.shards]
+        deadline = time.perf_counter() + self.timeout_s
+
+        answered = []
+        for shard, future in futures:
+            try:
+                answered.append((shard, future.result(timeout=max(0.0, deadline - time.perf_counter()))))
+            except FutureTimeoutError:
+                shard.discard(request_id)
+                RETRIEVAL_SHARD_FAILURES.labels(shard=str(shard.index), reason="timeout").inc()
+            except Exception as e:
+                if shard.alive:
+                    print(f"Retrieval shard {shard.index} failed: {e}")
+                RETRIEVAL_SHARD_FAILURES.labels(shard=str(shard.index),
+                                                reason="error" if shard.alive else "down").inc()
+
+        if not answered:
+            raise RuntimeError("No retrieval shard answered in time")
+        if len(answered) < len(self.shards):
+            current_budget().record("partial_retrieval")
+        return answered
+
+    def _merge(self, answered: list, position: int) -> tuple:
+        """Global top-k of the shards' BM25 and FAISS lists for one query, then RRF; with their agreement"""
+        bm25_ids, bm25_scores, faiss_ids, faiss_distances = [], [], [], []
+        for shard, results in answered:
+            (local_bm25, scores), (local_faiss, distances) = results[position]
+            bm25_ids.extend(shard.global_ids[local_bm25].tolist())
+            bm25_scores.extend(scores)
+            faiss_ids.extend(shard.global_ids[local_faiss].tolist())
+            faiss_distances.extend(distances)
+
+        # Ties go to the higher passage ID, as in BatchHybridRetriever
+        bm25_top = np.lexsort((-np.asarray(bm25_ids), -np.asarray(bm25_scores)))[:self.k]
+        faiss_top = np.argsort(np.asarray(faiss_distances), kind="stable")[:self.k]
+        bm25_ids = [bm25_ids[i] for i in bm25_top]
+        faiss_ids = [faiss_ids[i] for i in faiss_top]
+        return fuse_rankings([bm25_ids, faiss_ids], self.weights, self.rrf_c), rank_agreement(bm25_ids, faiss_ids)
+
+    def retrieve_with_agreement(self, queries: list, query_vectors=None) -> list:
+        """(fused candidate IDs, BM25/FAISS agreement) for each query, as BatchHybridRetriever"""
+        if not queries:
+            return []
+        if query_vectors is None:
+            query_vectors = self.embeddings.embed_documents(queries)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        with trace_stage("shard_search", shards=len(self.shards)):
+            answered = self._gather(queries, query_vectors)
+        return [self._merge(answered, position) for position in range(len(queries))]
+
+    def retrieve(self, queries: list) -> list:
+        """Return fused BM25 + FAISS candidate IDs for each query, in input order"""
+        return [ids for ids, _ in self.retrieve_with_agreement(queries)]
+
+    def invoke(self, query: str) -> list:
+        return self.retrieve([query])[0]
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self.shards),
+            "shards_alive": sum(shard.alive for shard in self.shards),
+            "passages_per_shard": [len(shard.global_ids) for shard in self.shards],
+        }
+
+    def close(self):
+        """Stop the shard processes"""
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,194 @@
+import re
+
+import numpy as np
+
+from context_builder import html_table_rows
+from config import table_slice_max_rows, table_lookup_min_match
+
+_NUMBER = re.compile(r"^[(\[]?\s*([-+−]?\d[\d,]*(?:\.\d+)?|[-+−]?\.\d+)")
+_TABLE_REF = re.compile(r"\btable\s+(\d+)", re.IGNORECASE)
+_CAPTION = re.compile(r"^\s*table\s+(\d+)", re.IGNORECASE | re.MULTILINE)
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def parse_number(cell: str):
+    """Leading numeric value of a cell ("3,578", "78.3%", "257 (7%)", "-0.4"), else None"""
+    match = _NUMBER.match(cell.strip())
+    if not match:
+        return None
+    try:
+        return float(match.group(1).replace(",", "").replace("−", "-"))
+    except ValueError:
+        return None
+
+
+def _tokens(text: str) -> set:
+    return set(_TOKEN.findall(text.lower()))
+
+
+def _match(label: str, query_tokens: set) -> float:
+    """Fraction of the label's tokens that appear in the query"""
+    tokens = _tokens(label)
+    if not tokens:
+        return 0.0
+    return len(tokens & query_tokens) / len(tokens)
+
+
+class TableFrame:
+    """
+    One table parsed into a typed columnar frame: headers, row labels (first column),
+    raw cell strings per column and a float matrix of numeric cells (NaN elsewhere).
+    captioned is False when number is only the table's position in the document
+    """
+
+    def __init__(self, number: int, page, chunk_id: int, table_idx: int, rows: list, captioned: bool = False):
+        width = max(len(row) for row in rows)
+        rows = [row + [""] * (width - len(row)) for row in rows]
+
+        first = [cell for cell in rows[0] if cell]
+        has_header = len(rows) > 1 and sum(parse_number(cell) is not None for cell in first) <= len(first) // 2
+        self.headers = rows[0] if has_header else [f"column {i + 1}" for i in range(width)]
+        body = rows[1:] if has_header else rows
+
+        self.number = number
+        self.captioned = captioned
+        self.page = page
+        self.chunk_id = chunk_id
+        self.table_idx = table_idx
+        self.cells = [[row[col] for row in body] for col in range(width)]
+        self.values = np.array([[parse_number(cell) if cell else None for cell in row] for row in body],
+                               dtype=np.float64).reshape(len(body), width)
+        numeric = ~np.isnan(self.values)
+        filled = np.array([[bool(cell) for cell in row] for row in body]).reshape(len(body), width)
+        self.dtypes = ["number" if filled[:, col].any() and numeric[:, col].sum() * 2 >= filled[:, col].sum()
+                       else "text" for col in range(width)]
+        self.row_labels = self.cells[0] if self.dtypes[0] == "text" else [f"row {i + 1}" for i in range(len(body))]
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    def match_columns(self, query_tokens: set) -> list:
+        """(column, score) for value columns whose header overlaps the query, best first"""
+        first = 1 if self.dtypes[0] == "text" else 0
+        scored = [(col, _match(self.headers[col], query_tokens)) for col in range(first, len(self.headers))]
+        return sorted([pair for pair in scored if pair[1] > 0], key=lambda pair: -pair[1])
+
+    def match_rows(self, query_tokens: set) -> list:
+        scored = [(row, _match(label, query_tokens)) for row, label in enumerate(self.row_labels)]
+        return sorted([pair for pair in scored if pair[1] > 0], key=lambda pair: -pair[1])
+
+    def cell(self, row: int, col: int) -> dict:
+        value = self.values[row, col]
+        return {"raw": self.cells[col][row], "value": None if np.isnan(value) else float(value)}
+
+    def to_text(self, rows=None, cols=None) -> str:
+        """Compact "a | b" rendering of the selected rows/columns (label column always kept)"""
+        n_rows, n_cols = self.shape
+        rows = list(range(n_rows)) if rows is None else rows
+        cols = list(range(n_cols)) if cols is None else cols
+        if self.dtypes[0] == "text" and 0 not in cols:
+            cols = [0] + cols
+        lines = [" | ".join(self.headers[c] for c in cols)]
+        lines.extend(" | ".join(self.cells[c][r] for c in cols) for r in rows)
+        if len(rows) < n_rows:
+            lines.append(f"({len(rows)} of {n_rows} rows)")
+        return "\n".join(lines)
+
+    def slice_for(self, query: str, max_rows: int = table_slice_max_rows) -> str:
+        """Rows and columns the query mentions; all columns / leading rows when nothing matches"""
+        query_tokens = _tokens(query)
+        rows = [row for row, _ in self.match_rows(query_tokens)][:max_rows]
+        cols = [col for col, _ in self.match_columns(query_tokens)]
+        if not rows:
+            rows = list(range(min(max_rows, self.shape[0])))
+        return self.to_text(sorted(rows), sorted(cols) if cols else None)
+
+
+class TableStore:
+    """Tables of one document, parsed once at ingestion"""
+
+    def __init__(self, frames: list):
+        self.frames = frames
+
+    @classmethod
+    def from_sections(cls, sections) -> "TableStore":
+        frames = []
+        for table_idx, table_html in enumerate(sections.tables):
+            rows = html_table_rows(table_html)
+            if not rows:
+                continue
+            chunk_id = int(sections.table_chunk[table_idx])
+            # Use the caption number when the owning section holds exactly one captioned table
+            # (otherwise number by position, which may not be the printed number)
+            captions = _CAPTION.findall(sections.text(chunk_id))
+            captioned = len(captions) == 1 and len(sections.tables_of(chunk_id)) == 1
+            number = int(captions[0]) if captioned else len(frames) + 1
+            frames.append(TableFrame(number, sections.page(chunk_id), chunk_id, table_idx, rows, captioned))
+        return cls(frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def covers(self, sections, chunk_id: int) -> bool:
+        """True when every table of the chunk was parsed into a frame"""
+        parsed = sum(1 for frame in self.frames if frame.chunk_id == chunk_id)
+        return parsed == len(sections.tables_of(chunk_id))
+
+    def rank(self, query: str, chunk_ids=()) -> list:
+        """(frame, score) for tables relevant to the query: named table, header/label overlap, retrieved chunk"""
+        query_tokens = _tokens(query)
+        named = {int(n) for n in _TABLE_REF.findall(query)}
+        ranked = []
+        for frame in self.frames:
+            columns = frame.match_columns(query_tokens)
+            rows = frame.match_rows(query_tokens)
+            score = (columns[0][1] if columns else 0.0) + (rows[0][1] if rows else 0.0)
+            if frame.number in named:
+                score += 2.0
+            if frame.chunk_id in chunk_ids:
+                score += 0.5
+            if score > 0:
+                ranked.append((frame, score))
+        ranked.sort(key=lambda pair: -pair[1])
+        return ranked
+
+    def lookup(self, query: str):
+        """
+        Answer "what is X for Y in Table N" from the parsed cells. Only returns a hit
+        when the query names a table whose number came from its caption and one row
+        label and one column header clearly match; anything less is left to the LLM
+        """
+        named = {int(n) for n in _TABLE_REF.findall(query)}
+        if len(named) != 1:
+            return None
+        number = named.pop()
+        query_tokens = _tokens(_TABLE_REF.sub(" ", query))
+
+        hits = []
+        for frame in self.frames:
+            # A position-numbered "Table 2" may be a different table than the paper's Table 2
+            if not frame.captioned or frame.number != number:
+                continue
+            columns = frame.match_columns(query_tokens)
+            rows = frame.match_rows(query_tokens)
+            if not columns or not rows:
+                continue
+            (col, col_score), (row, row_score) = columns[0], rows[0]
+            # Ties mean the question does not single out one cell
+            if len(columns) > 1 and columns[1][1] == col_score or len(rows) > 1 and rows[1][1] == row_score:
+                continue
+            if min(col_score, row_score) >= table_lookup_min_match and frame.cells[col][row]:
+                hits.append((frame, row, col))
+        if len(hits) != 1:
+            return None
+
+        frame, row, col = hits[0]
+        return {
+            "table": frame.number,
+            "page_number": frame.page,
+            "chunk_id": frame.chunk_id,
+            "row": frame.row_labels[row],
+            "column": frame.headers[col],
+            **frame.cell(row, col),
+        }
@@ -0,0 +1,119 @@
+import hashlib
+
+import aiofiles
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+
+from config import upload_chunk_bytes, upload_max_bytes
+
+# Boundaries and part headers around the file in a multipart body
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File exceeds the {upload_max_bytes // (1024 * 1024)} MB upload limit")
+
+
+def check_content_length(request: Request):
+    """Reject an upload whose declared body is already over the limit, before reading any of it"""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > upload_max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise too_large()
+
+
+class _FilePart:
+    """python-multipart callbacks keeping the bytes of the first file in the named form field"""
+
+    def __init__(self, field_name: str):
+        self.field_name = field_name.encode()
+        self.found = False
+        self.pending = []
+        self._in_file = False
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field_data,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_field_data(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_file = not self.found and options.get(b"name") == self.field_name and b"filename" in options
+        self.found = self.found or self._in_file
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self.pending.append(data[start:end])
+
+    def _part_end(self):
+        self._in_file = False
+
+    def take(self) -> list:
+        pending, self.pending = self.pending, []
+        return pending
+
+
+async def stream_upload_to_disk(request: Request, dest_path: str, field_name: str = "file") -> str:
+    """
+    Parse the multipart body as it arrives and copy the named file field to disk,
+    hashing on the fly. The size limit is checked on every received chunk, so an
+    oversized upload is cut off instead of being received in full
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    part = _FilePart(field_name)
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+    digest = hashlib.sha256()
+    size = 0
+    batch = []
+
+    async with aiofiles.open(dest_path, "wb") as out:
+        async def flush(force: bool = False):
+            nonlocal size, batch
+            for data in part.take():
+                size += len(data)
+                if size > upload_max_bytes:
+                    raise too_large()
+                digest.update(data)
+                batch.append(data)
+            # Disk writes in upload_chunk_bytes batches, not per network read
+            if batch and (force or sum(map(len, batch)) >= upload_chunk_bytes):
+                await out.write(b"".join(batch))
+                batch = []
+
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await flush()
+            parser.finalize()
+        except MultipartParseError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed multipart upload: {e}")
+        await flush(force=True)
+
+    if not part.found:
+        raise HTTPException(status_code=400, detail=f"No file in the '{field_name}' form field")
+    return digest.hexdigest()